@@ -1,19 +1,155 @@
 import cv2
 import os
-import glob
 import numpy as np
 import base64
 import re
 import shutil
-import uuid
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import struct
+import queue
+import time
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, jsonify, render_template, send_from_directory, g, Response
 from flask_cors import CORS
 from deepface import DeepFace
+from deepface.modules import modeling
+from config import MODEL_NAME, DETECTOR_BACKEND, DETECTION_CONFIDENCE, SIMILARITY_THRESHOLD
+from embedding_store import EmbeddingStore, user_of
+from matcher import create_matcher
+from inference import InferenceScheduler
+from shared_gallery import SharedGallery
+import metrics
+from metrics import span
+from stream_sessions import SessionRegistry
+from probe_cache import ProbeCache, face_key
+from liveness import assess_face, RecentVerdicts, REJECTION_MESSAGES
+from face_images import (align_face, content_name, remove_face_image, remove_thumbnails, save_face_image,
+                         save_thumbnail, thumbnail_path)
+from video_pipeline import FrameSource
+from user_catalog import UserCatalog
 
 # --- Configuration ---
 # The path to your face database.
 DB_PATH = "./database"
 
+# The face detector and recognition model are selected in config.py.
+
+# Gallery search index: "exact" scans every embedding, "ivf" is an approximate
+# nearest-neighbour index for very large galleries. Use benchmark_ann.py to
+# pick IVF_NLIST / IVF_NPROBE for your gallery size.
+# "quantized" keeps only compressed vectors in memory (QUANTIZATION: "float16",
+# "int8" or "pq") and rescores the best RESCORE_CANDIDATES matches against the
+# full-precision embeddings, which are then memory-mapped from the store instead
+# of loaded into RAM. Use benchmark_quantization.py to compare the options.
+# "template" aggregates each user's images into up to TEMPLATES_PER_USER
+# templates (their mean, or cluster centers), searches those first and rescores
+# only the images of the TEMPLATE_SHORTLIST best users, so search cost grows
+# with the number of users rather than photos. benchmark_ann.py --templates
+# compares it with exact search.
+INDEX_MODE = "exact"
+IVF_NLIST = 256
+IVF_NPROBE = 16
+QUANTIZATION = "int8"
+RESCORE_CANDIDATES = 32
+PQ_SUBVECTORS = 64
+TEMPLATES_PER_USER = 1
+TEMPLATE_SHORTLIST = 5
+
+# Production serving with several worker processes (see gunicorn.conf.py):
+# the gallery matrix is published to a memory-mapped file in DB_PATH that all
+# workers map read-only, instead of every worker holding its own copy.
+SHARED_GALLERY = os.environ.get("FACE_SHARED_GALLERY") == "1"
+
+# Set FACE_TIMING_HEADERS=1 to return a Server-Timing header with per-stage
+# durations on every response, to correlate client-side slowness.
+TIMING_HEADERS = os.environ.get("FACE_TIMING_HEADERS") == "1"
+
+# Maximum number of images accepted by a single /verify/batch request.
+MAX_BATCH_IMAGES = 32
+
+# Frames are decoded to at most MAX_IMAGE_SIZE pixels on the long side (face
+# crops for embedding come from this resolution), while face detection runs
+# on a copy downscaled to DETECTION_MAX_SIZE.
+MAX_IMAGE_SIZE = 1024
+DETECTION_MAX_SIZE = 640
+
+# Inference scheduler: handlers queue decoded frames and a worker runs up to
+# INFERENCE_MAX_BATCH_SIZE of them per model call, waiting at most
+# INFERENCE_MAX_WAIT_MS for a batch to fill. Requests beyond
+# INFERENCE_QUEUE_DEPTH are rejected with 503 instead of piling up.
+INFERENCE_WORKERS = 1
+INFERENCE_MAX_BATCH_SIZE = 8
+INFERENCE_MAX_WAIT_MS = 5
+INFERENCE_QUEUE_DEPTH = 64
+INFERENCE_TIMEOUT = 30
+
+# Probe cache: /verify results are reused for PROBE_CACHE_TTL seconds when the
+# same face shows up again: a 256-bit face crop hash within
+# PROBE_CACHE_MAX_HASH_DISTANCE bits and brightness within
+# PROBE_CACHE_MAX_BRIGHTNESS_DELTA, or a probe embedding at least
+# PROBE_CACHE_MIN_SIMILARITY cosine similar. Set PROBE_CACHE_TTL = 0 to disable.
+PROBE_CACHE_TTL = 2.0
+PROBE_CACHE_SIZE = 256
+PROBE_CACHE_MAX_HASH_DISTANCE = 16
+PROBE_CACHE_MAX_BRIGHTNESS_DELTA = 10
+PROBE_CACHE_MIN_SIMILARITY = 0.97
+
+# Liveness pre-filter: before anti-spoofing, faces smaller than
+# LIVENESS_MIN_FACE_SIZE pixels (in the decoded frame), blurrier than
+# LIVENESS_MIN_SHARPNESS (variance of the Laplacian), darker or brighter on
+# average than LIVENESS_MIN_BRIGHTNESS / LIVENESS_MAX_BRIGHTNESS, or turned away
+# (eye line tilted more than LIVENESS_MAX_ROLL degrees, or the eyes' midpoint off
+# center by more than LIVENESS_MAX_YAW_OFFSET of the face width) are rejected
+# with a reason the client can show. Set a threshold to 0 to disable its check.
+# Clients that send a 'session' id reuse a "real" anti-spoofing verdict for a
+# face in the same place for LIVENESS_REUSE_SECONDS (0 disables reuse).
+LIVENESS_PREFILTER = True
+LIVENESS_MIN_FACE_SIZE = 80
+LIVENESS_MIN_SHARPNESS = 30
+LIVENESS_MIN_BRIGHTNESS = 40
+LIVENESS_MAX_BRIGHTNESS = 220
+LIVENESS_MAX_ROLL = 25
+LIVENESS_MAX_YAW_OFFSET = 0.2
+LIVENESS_REUSE_SECONDS = 3.0
+
+# Streaming sessions (/stream): clients push frames continuously and receive
+# results as server-sent events only when they change. Faces are detected every
+# STREAM_DETECT_EVERY_N_FRAMES frames and tracked in between; a spoof is
+# reported by majority over the last STREAM_SPOOF_HISTORY checks of a face.
+# Sessions without frames for STREAM_SESSION_TTL seconds are closed. Video
+# files in STREAM_VIDEO_DIR can be used as a session's frame source.
+STREAM_DETECT_EVERY_N_FRAMES = 5
+STREAM_SPOOF_HISTORY = 3
+STREAM_MAX_SESSIONS = 32
+STREAM_SESSION_TTL = 60
+STREAM_KEEPALIVE = 15
+STREAM_VIDEO_DIR = "./videos"
+
+# /users returns USERS_PAGE_SIZE users per page when a 'page' is requested
+# (clients may ask for up to USERS_MAX_PAGE_SIZE with 'per_page'); without one
+# it returns every user, as before.
+USERS_PAGE_SIZE = 100
+USERS_MAX_PAGE_SIZE = 1000
+
+# Registration stores an aligned face crop and a thumbnail (face_images.py)
+# instead of the uploaded frame. An upload byte-identical to one of the user's
+# stored images is ignored before any model runs, and a face at least
+# REGISTER_DUPLICATE_SIMILARITY cosine similar to one of the user's stored
+# faces is reported as a duplicate instead of being stored (1.0 disables the
+# embedding check). compact_gallery.py rewrites older databases this way.
+REGISTER_DUPLICATE_SIMILARITY = 0.97
+
+# Startup: the detector, recognition and anti-spoofing models are loaded in
+# parallel threads (set WARMUP_PARALLEL = False if a model backend misbehaves
+# when built concurrently) while the gallery loads from the store snapshot.
+# The database folder is scanned for images added or changed by hand only when
+# FACE_STARTUP_SYNC is "always", or with "auto" (the default) when there is no
+# snapshot yet or its embedding matrix can't be read; /register, /delete and enroll.py keep the store current
+# themselves. "never" skips the scan entirely.
+WARMUP_PARALLEL = True
+STARTUP_SYNC = os.environ.get("FACE_STARTUP_SYNC", "auto")
+
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
@@ -29,6 +165,107 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 # initialized only once when the application starts.
 models = {}
 
+# --- Embedding Store ---
+# Holds one embedding per database image. /register and /delete update it
+# incrementally so verification never has to re-embed the whole database.
+store = EmbeddingStore(DB_PATH, MODEL_NAME, mmap=INDEX_MODE == "quantized" and not SHARED_GALLERY)
+
+# --- User Catalog ---
+# Users and their images, built from disk at startup (user_catalog.py), so the
+# admin endpoints and /verify never list the database folder.
+catalog = UserCatalog(DB_PATH)
+
+# --- In-Memory Matcher ---
+# Gallery embeddings held in memory and searched on every /verify.
+if SHARED_GALLERY:
+    # Workers search the shared memory map directly, so only exact search applies
+    matcher = create_matcher("exact")
+    shared_gallery = SharedGallery(DB_PATH, MODEL_NAME)
+elif INDEX_MODE == "ivf":
+    matcher = create_matcher(INDEX_MODE, nlist=IVF_NLIST, nprobe=IVF_NPROBE)
+elif INDEX_MODE == "quantized":
+    matcher = create_matcher(INDEX_MODE, precision=QUANTIZATION, rescore=RESCORE_CANDIDATES, pq_subvectors=PQ_SUBVECTORS)
+elif INDEX_MODE == "template":
+    matcher = create_matcher(INDEX_MODE, templates_per_user=TEMPLATES_PER_USER, shortlist=TEMPLATE_SHORTLIST)
+else:
+    matcher = create_matcher(INDEX_MODE)
+
+def refresh_gallery():
+    """
+    Remaps the shared gallery if another worker changed it.
+    """
+    if SHARED_GALLERY and shared_gallery.refresh():
+        matcher.attach(shared_gallery.identities, shared_gallery.matrix)
+        # Another worker registered or deleted someone; cached results and the catalog may be stale
+        probe_cache.clear()
+        catalog.sync_gallery(shared_gallery.identities)
+
+def gallery_add(identity, embedding):
+    """
+    Persists a new gallery embedding and makes it searchable.
+    """
+    if SHARED_GALLERY:
+        with shared_gallery.lock:
+            store.add(identity, embedding)
+            shared_gallery.append(identity, embedding)
+        refresh_gallery()
+    else:
+        store.add(identity, embedding)
+        matcher.add(identity, embedding)
+    probe_cache.invalidate()
+
+def user_embeddings(name):
+    """
+    Returns (identities, L2-normalized embedding matrix) of a user's stored images.
+    """
+    if SHARED_GALLERY:
+        refresh_gallery()
+        if shared_gallery.matrix is None:
+            return [], None
+        rows = [(identity, vector) for identity, vector in zip(shared_gallery.identities, shared_gallery.matrix)
+                if user_of(identity) == name]
+    else:
+        with store.lock:
+            rows = [(identity, record["embedding"]) for identity, record in store.records.items()
+                    if user_of(identity) == name]
+    if not rows:
+        return [], None
+    matrix = np.stack([np.asarray(vector, dtype=np.float32) for _, vector in rows])
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return [identity for identity, _ in rows], matrix
+
+def find_duplicate(name, embedding):
+    """
+    Returns (identity, similarity) of the user's stored image most similar to
+    the embedding if it reaches REGISTER_DUPLICATE_SIMILARITY, else None.
+    """
+    if REGISTER_DUPLICATE_SIMILARITY >= 1:
+        return None
+    identities, matrix = user_embeddings(name)
+    if matrix is None:
+        return None
+    vector = np.asarray(embedding, dtype=np.float32)
+    similarities = matrix @ (vector / (np.linalg.norm(vector) or 1.0))
+    best = int(np.argmax(similarities))
+    if similarities[best] < REGISTER_DUPLICATE_SIMILARITY:
+        return None
+    return identities[best], float(similarities[best])
+
+def gallery_remove_user(name):
+    """
+    Drops every embedding of a user from the store and the searchable gallery.
+    """
+    if SHARED_GALLERY:
+        with shared_gallery.lock:
+            store.remove_user(name)
+            shared_gallery.remove_user(name)
+            gallery_rebuilds.inc()
+        refresh_gallery()
+    else:
+        store.remove_user(name)
+        matcher.remove_user(name)
+    probe_cache.invalidate(name)
+
 def resize_image(image, max_size=1024):
     """
     Resizes an image to a maximum size, preserving aspect ratio.
@@ -41,12 +278,708 @@ def resize_image(image, max_size=1024):
         return cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
     return image
 
+def encoded_image_size(image_data):
+    """
+    Reads (width, height) from a JPEG or PNG header without decoding the image.
+    Returns None for other formats or malformed headers.
+    """
+    if image_data[:8] == b'\x89PNG\r\n\x1a\n' and len(image_data) >= 24:
+        return struct.unpack('>II', image_data[16:24])
+
+    if image_data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(image_data):
+        if image_data[i] != 0xFF:
+            return None
+        marker = image_data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            # Start-of-frame segment: length, precision, height, width
+            height, width = struct.unpack('>HH', image_data[i + 5:i + 9])
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a length field
+            i += 2
+            continue
+        segment_length = struct.unpack('>H', image_data[i + 2:i + 4])[0]
+        i += 2 + segment_length
+    return None
+
+def reduced_decode_flag(image_data, max_size):
+    """
+    Picks the cheapest OpenCV decode flag that still yields at least max_size
+    pixels on the long side. JPEG decoders can skip work at 1/2, 1/4 and 1/8 scale.
+    """
+    size = encoded_image_size(image_data)
+    if size:
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) / factor >= max_size:
+                return flag
+    return cv2.IMREAD_COLOR
+
+def check_spoof(image, facial_area):
+    """
+    Runs DeepFace's anti-spoofing model on one detected face.
+    Returns (is_real, score).
+    """
+    antispoof_model = modeling.build_model(task="spoofing", model_name="Fasnet")
+    return antispoof_model.analyze(
+        img=image,
+        facial_area=(facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h'])
+    )
+
+def check_spoofs(image, facial_areas):
+    """
+    Runs the anti-spoofing model on several faces of one image. Fasnet's two
+    networks each run once on a stacked batch of face crops where DeepFace's
+    implementation allows it; otherwise faces are checked one at a time.
+    Returns [(is_real, score)] in the order of facial_areas.
+    """
+    if len(facial_areas) <= 1:
+        return [check_spoof(image, facial_area) for facial_area in facial_areas]
+    antispoof_model = modeling.build_model(task="spoofing", model_name="Fasnet")
+    try:
+        import torch
+        import torch.nn.functional as F
+        from deepface.models.spoofing.FasNet import crop, ToTensor
+        # Same crop scales and input size as Fasnet.analyze()
+        networks = ((antispoof_model.first_model, 2.7), (antispoof_model.second_model, 4))
+        device = antispoof_model.device
+    except (ImportError, AttributeError):
+        # Older or newer DeepFace releases: no access to the networks themselves
+        return [check_spoof(image, facial_area) for facial_area in facial_areas]
+
+    boxes = [(facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']) for facial_area in facial_areas]
+    to_tensor = ToTensor()
+    prediction = np.zeros((len(boxes), 3))
+    with torch.no_grad():
+        for network, scale in networks:
+            batch = torch.stack([to_tensor(crop(image, box, scale, 80, 80)) for box in boxes]).to(device)
+            prediction += F.softmax(network.forward(batch), dim=1).cpu().numpy()
+    labels = np.argmax(prediction, axis=1)
+    return [(bool(label == 1), float(prediction[i][label] / 2)) for i, label in enumerate(labels)]
+
+def detect_faces(frame, timings=None):
+    """
+    Runs face detection on a downscaled copy of the frame and maps the
+    facial areas back to the frame's own coordinates. Anti-spoofing runs
+    separately, on faces that pass the liveness pre-filter (check_spoofs).
+    """
+    small = resize_image(frame, DETECTION_MAX_SIZE)
+    with span("detect", timings):
+        face_objs = DeepFace.extract_faces(
+            img_path=small,
+            detector_backend=DETECTOR_BACKEND,
+            enforce_detection=False
+        )
+
+    scale = frame.shape[1] / small.shape[1]
+    if scale != 1:
+        for face_obj in face_objs:
+            facial_area = face_obj['facial_area']
+            for key in ('x', 'y', 'w', 'h'):
+                facial_area[key] = int(round(facial_area[key] * scale))
+            for key in ('left_eye', 'right_eye'):
+                if facial_area.get(key) is not None:
+                    facial_area[key] = tuple(int(round(v * scale)) for v in facial_area[key])
+    return face_objs
+
+def embed_face(face_roi):
+    """
+    Returns the embedding vector for an already cropped face region.
+    """
+    embedding_objs = DeepFace.represent(
+        img_path=face_roi,
+        model_name=MODEL_NAME,
+        detector_backend="skip",
+        enforce_detection=False
+    )
+    return embedding_objs[0]['embedding']
+
+def embed_faces(face_rois):
+    """
+    Returns embeddings for several cropped faces using one batched model call.
+    """
+    if len(face_rois) <= 1:
+        return [embed_face(face_roi) for face_roi in face_rois]
+    try:
+        embedding_objs = DeepFace.represent(
+            img_path=list(face_rois),
+            model_name=MODEL_NAME,
+            detector_backend="skip",
+            enforce_detection=False
+        )
+    except (TypeError, ValueError):
+        # Older DeepFace releases only accept a single image per call
+        return [embed_face(face_roi) for face_roi in face_rois]
+    return [objs[0]['embedding'] for objs in embedding_objs]
+
+def crop_face(frame, face_obj):
+    """
+    Crops the detected facial area out of the frame.
+    """
+    facial_area = face_obj['facial_area']
+    x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
+    return frame[y:y+h, x:x+w]
+
+def embed_image_file(image_path):
+    """
+    Detects the face in a database image and returns its embedding,
+    or None if no clear face is found.
+    """
+    with open(image_path, 'rb') as f:
+        frame = decode_image(f.read())
+    if frame is None:
+        return None
+
+    embedding = embed_main_face(frame)
+    if embedding is None:
+        print(f"-> No clear face in '{image_path}'. Skipping.")
+    return embedding
+
+def detect_main_face(frame, timings=None):
+    """
+    Returns the face object of the main face in a frame, or None if no clear face is found.
+    """
+    face_objs = detect_faces(frame, timings=timings)
+    if not face_objs or face_objs[0]['confidence'] < DETECTION_CONFIDENCE:
+        return None
+    return face_objs[0]
+
+def embed_main_face(frame, timings=None):
+    """
+    Returns the embedding of the main face in a frame, or None if no clear face is found.
+    """
+    face_obj = detect_main_face(frame, timings)
+    if face_obj is None:
+        return None
+    with span("embed", timings):
+        return embed_face(crop_face(frame, face_obj))
+
+def register_face(frame, timings=None):
+    """
+    Returns (face object, embedding) of the main face in a frame, or None if
+    no clear face is found.
+    """
+    face_obj = detect_main_face(frame, timings)
+    if face_obj is None:
+        return None
+    with span("embed", timings):
+        return face_obj, embed_face(crop_face(frame, face_obj))
+
+def request_image_data():
+    """
+    Returns the encoded image bytes sent with the request, or None if missing.
+    Accepts a raw image body (e.g. Content-Type: image/jpeg), a multipart
+    'image' file, or base64 in a JSON 'image' key as a fallback.
+    """
+    if 'image' in request.files:
+        return request.files['image'].read()
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        return request.get_data(cache=False) or None
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict) and 'image' in payload:
+        return decode_base64(payload['image'])
+    return None
+
+def decode_base64(image_b64):
+    """
+    Returns the bytes of a base64 string, or None if it is not valid base64.
+    """
+    try:
+        return base64.b64decode(image_b64, validate=True) or None
+    except (TypeError, ValueError):
+        return None
+
+def request_field(key):
+    """
+    Returns a text field from the JSON payload, multipart form or query string.
+    """
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict) and key in payload:
+        return payload[key]
+    return request.form.get(key) or request.args.get(key)
+
+def decode_image(image_data):
+    """
+    Decodes encoded image bytes and resizes the image for processing.
+    Returns None if the data is missing or not a valid image.
+    """
+    if not image_data:
+        return None
+    # frombuffer wraps the request bytes without copying them
+    nparr = np.frombuffer(image_data, np.uint8)
+    frame = cv2.imdecode(nparr, reduced_decode_flag(image_data, MAX_IMAGE_SIZE))
+    if frame is None:
+        return None
+    return resize_image(frame, MAX_IMAGE_SIZE)
+
+def verification_results(embeddings):
+    """
+    Searches the gallery for several embeddings at once and builds a /verify
+    response body for each.
+    """
+    return [match_result(matches) for matches in matcher.search_many(embeddings, k=1)]
+
+def verification_result(embedding):
+    """
+    Searches the gallery for an embedding and builds the /verify response body.
+    """
+    return verification_results([embedding])[0]
+
+def match_result(matches):
+    """
+    Builds the /verify response body from a probe's best gallery matches.
+    """
+    if not matches:
+        return {"status": "Unverified", "message": "Unknown person."}
+
+    identity, similarity = matches[0]
+
+    # Convert cosine similarity to a percentage
+    similarity_percent = similarity * 100
+
+    if similarity_percent >= SIMILARITY_THRESHOLD:
+        return {
+            "status": "Verified",
+            "id": user_of(identity),
+            "similarity": f"{similarity_percent:.2f}%"
+        }
+    return {
+        "status": "Unverified",
+        "message": f"Verification failed: Similarity ({similarity_percent:.2f}%) is below the {SIMILARITY_THRESHOLD:g}% threshold.",
+        "similarity": f"{similarity_percent:.2f}%"
+    }
+
+def prefilter_face(frame, facial_area):
+    """
+    Runs the liveness pre-filter on a detected face. Returns a 'Rejected'
+    result with the reason, or None if the face is usable.
+    """
+    if not LIVENESS_PREFILTER:
+        return None
+    reason = assess_face(
+        frame, facial_area,
+        min_face_size=LIVENESS_MIN_FACE_SIZE,
+        min_sharpness=LIVENESS_MIN_SHARPNESS,
+        min_brightness=LIVENESS_MIN_BRIGHTNESS,
+        max_brightness=LIVENESS_MAX_BRIGHTNESS,
+        max_roll=LIVENESS_MAX_ROLL,
+        max_yaw_offset=LIVENESS_MAX_YAW_OFFSET
+    )
+    if reason is None:
+        return None
+    liveness_rejects.inc(reason=reason)
+    return {"status": "Rejected", "reason": reason, "message": REJECTION_MESSAGES[reason]}
+
+def analyze_frames(requests):
+    """
+    Runs detection, the liveness pre-filter and one batched anti-spoofing pass
+    on every frame, then a single batched embedding call and gallery search
+    for all real faces of all frames. Faces found in the probe cache skip
+    anti-spoofing, embedding and search. Takes a list of (frame, timings,
+    session, all_faces) tuples, where timings is a dict collecting per-stage
+    milliseconds for the request (or None), session is the client's session
+    id (or None) and all_faces asks for every face instead of only the main
+    (first detected) one. Returns, per frame, a list of face results (each
+    with a 'box') in detection order.
+    """
+    refresh_gallery()
+    batch_size.observe(len(requests))
+
+    faces_per_frame = []
+    pending = []  # (face result, face ROI, face key) waiting for the batched embedding call
+    for frame, timings, session, all_faces in requests:
+        face_objs = [face_obj for face_obj in detect_faces(frame, timings=timings)
+                     if face_obj['confidence'] >= DETECTION_CONFIDENCE]
+        if not all_faces:
+            # Only the main face is answered, so the others aren't checked, embedded or searched
+            face_objs = face_objs[:1]
+
+        faces = []
+        unchecked = []  # (face result, facial area, face ROI, face key) for anti-spoofing
+        for face_obj in face_objs:
+            facial_area = face_obj['facial_area']
+            face = {"box": {key: int(facial_area[key]) for key in ('x', 'y', 'w', 'h')}}
+            faces.append(face)
+
+            # Too small, blurred, badly lit or turned away: tell the client why, skip everything else
+            rejection = prefilter_face(frame, facial_area)
+            if rejection is not None:
+                face.update(rejection)
+                verify_results.inc(status="Rejected")
+                continue
+            face_roi = crop_face(frame, face_obj)
+
+            # A face seen moments ago reuses its result: no anti-spoofing, embedding or search
+            roi_key = None
+            if PROBE_CACHE_TTL:
+                roi_key = face_key(face_roi)
+                cached = probe_cache.lookup_face(roi_key)
+                if cached is not None:
+                    probe_cache_lookups.inc(result="hit_face")
+                    face.update(cached)
+                    verify_results.inc(status=face['status'])
+                    continue
+
+            # The same session had a real verdict for a face in this place moments ago
+            if session and LIVENESS_REUSE_SECONDS and recent_verdicts.lookup(session, box_tuple(face['box'])):
+                liveness_reused.inc()
+                pending.append((face, face_roi, roi_key))
+                continue
+            unchecked.append((face, facial_area, face_roi, roi_key))
+
+        if unchecked:
+            with span("antispoof", timings):
+                verdicts = check_spoofs(frame, [facial_area for _, facial_area, _, _ in unchecked])
+            for (face, _, face_roi, roi_key), (is_real, _) in zip(unchecked, verdicts):
+                if is_real:
+                    if session and LIVENESS_REUSE_SECONDS:
+                        recent_verdicts.put(session, box_tuple(face['box']))
+                    pending.append((face, face_roi, roi_key))
+                    continue
+                result = {"status": "Failed", "message": "Spoof attempt detected."}
+                face.update(result)
+                spoof_rejects.inc()
+                verify_results.inc(status="Failed")
+                if PROBE_CACHE_TTL:
+                    probe_cache.miss()
+                    probe_cache_lookups.inc(result="miss")
+                    probe_cache.put(roi_key, None, result)
+        if not faces:
+            verify_results.inc(status="NoFace")
+        faces_per_frame.append(faces)
+
+    # Embedding and search run once for the whole batch; every request waited for them
+    batch_timings = {}
+    with span("embed", batch_timings):
+        embeddings = embed_faces([face_roi for _, face_roi, _ in pending])
+    with span("match", batch_timings):
+        searches = []  # (face result, embedding, face key) not answered by the probe cache
+        for (face, _, roi_key), embedding in zip(pending, embeddings):
+            cached = None
+            if PROBE_CACHE_TTL:
+                cached = probe_cache.lookup_embedding(embedding)
+                probe_cache_lookups.inc(result="miss" if cached is None else "hit_embedding")
+            if cached is None:
+                searches.append((face, embedding, roi_key))
+                continue
+            probe_cache.put(roi_key, embedding, cached)
+            face.update(cached)
+            verify_results.inc(status=face['status'])
+
+        # One matrix search for every probe of the batch
+        results = verification_results([embedding for _, embedding, _ in searches])
+        for (face, embedding, roi_key), result in zip(searches, results):
+            if PROBE_CACHE_TTL:
+                probe_cache.put(roi_key, embedding, result)
+            face.update(result)
+            verify_results.inc(status=face['status'])
+    for timings in {id(timings): timings for _, timings, _, _ in requests if timings is not None}.values():
+        for stage, ms in batch_timings.items():
+            timings[stage] = timings.get(stage, 0) + ms
+    return faces_per_frame
+
+def box_tuple(box):
+    return box['x'], box['y'], box['w'], box['h']
+
+def detect_boxes(frame):
+    """
+    Returns (box, confidence) for every face above DETECTION_CONFIDENCE.
+    """
+    return [((face_obj['facial_area']['x'], face_obj['facial_area']['y'],
+              face_obj['facial_area']['w'], face_obj['facial_area']['h']), face_obj['confidence'])
+            for face_obj in detect_faces(frame) if face_obj['confidence'] >= DETECTION_CONFIDENCE]
+
+def recognize_boxes(frame, boxes):
+    """
+    Liveness pre-filter, anti-spoofing and verification for already located
+    (x, y, w, h) faces, with one batched embedding call for the real ones.
+    """
+    refresh_gallery()
+    results, unchecked = [], []
+    frame_h, frame_w = frame.shape[:2]
+    for x, y, w, h in boxes:
+        # Tracked boxes can drift past the frame edge
+        x0, y0 = max(0, x), max(0, y)
+        w, h = min(frame_w, x + w) - x0, min(frame_h, y + h) - y0
+        result = {}
+        results.append(result)
+        if w <= 0 or h <= 0:
+            result.update({"status": "Unverified", "message": "No face detected."})
+            continue
+        facial_area = {'x': x0, 'y': y0, 'w': w, 'h': h}
+        rejection = prefilter_face(frame, facial_area)
+        if rejection is not None:
+            result.update(rejection)
+        else:
+            unchecked.append((result, facial_area))
+
+    pending = []
+    with span("antispoof"):
+        verdicts = check_spoofs(frame, [facial_area for _, facial_area in unchecked])
+    for (result, facial_area), (is_real, _) in zip(unchecked, verdicts):
+        if is_real:
+            pending.append((result, crop_face(frame, {'facial_area': facial_area})))
+        else:
+            result.update({"status": "Failed", "message": "Spoof attempt detected."})
+            spoof_rejects.inc()
+
+    with span("embed"):
+        embeddings = embed_faces([face_roi for _, face_roi in pending])
+    with span("match"):
+        for (result, _), match in zip(pending, verification_results(embeddings)):
+            result.update(match)
+    for result in results:
+        verify_results.inc(status=result['status'])
+    return results
+
+def image_result(faces):
+    """
+    Builds the /verify response body for a frame from its main face.
+    """
+    if not faces:
+        return {"status": "Unverified", "message": "No face detected."}
+    return {key: value for key, value in faces[0].items() if key != 'box'}
+
+# --- Metrics ---
+request_seconds = metrics.Histogram("face_request_seconds", "End-to-end request latency by endpoint.")
+batch_size = metrics.Histogram("face_inference_batch_size", "Frames per inference batch.", buckets=(1, 2, 4, 8, 16, 32, 64))
+verify_results = metrics.Counter("face_verify_results_total", "Faces processed by verification, by outcome (Verified, Unverified, Failed = spoof, Rejected = pre-filter, NoFace).")
+spoof_rejects = metrics.Counter("face_spoof_rejects_total", "Faces rejected by the anti-spoofing model.")
+gallery_rebuilds = metrics.Counter("face_gallery_rebuilds_total", "Full rebuilds of the searchable gallery (startup sync, shared gallery republish).")
+duplicate_registrations = metrics.Counter("face_duplicate_registrations_total", "Registrations skipped as duplicates, by kind (identical bytes, similar embedding).")
+images_embedded = metrics.Counter("face_images_embedded_total", "Database images embedded by the startup sync.")
+metrics.Gauge("face_gallery_size", "Embeddings in the searchable gallery.", lambda: len(matcher))
+metrics.Gauge("face_users", "Users in the user catalog.", lambda: len(catalog))
+
+# --- Probe Cache ---
+probe_cache_lookups = metrics.Counter("face_probe_cache_lookups_total", "Probe cache lookups by result (hit_face, hit_embedding, miss).")
+probe_cache_evictions = metrics.Counter("face_probe_cache_evictions_total", "Probe cache entries removed, by reason (expired, lru, invalidated).")
+probe_cache = ProbeCache(
+    ttl=PROBE_CACHE_TTL,
+    max_entries=PROBE_CACHE_SIZE,
+    max_hash_distance=PROBE_CACHE_MAX_HASH_DISTANCE,
+    max_brightness_delta=PROBE_CACHE_MAX_BRIGHTNESS_DELTA,
+    min_similarity=PROBE_CACHE_MIN_SIMILARITY,
+    on_evict=lambda reason, count: probe_cache_evictions.inc(count, reason=reason)
+)
+metrics.Gauge("face_probe_cache_entries", "Results currently in the probe cache.", lambda: len(probe_cache))
+metrics.Gauge("face_probe_cache_hit_ratio", "Share of probe cache lookups that were hits since startup.", lambda: probe_cache.hit_ratio())
+
+# --- Liveness ---
+liveness_rejects = metrics.Counter("face_liveness_rejects_total", "Faces rejected by the liveness pre-filter, by reason (too_small, blurry, too_dark, too_bright, pose).")
+liveness_reused = metrics.Counter("face_liveness_reused_total", "Faces that reused their session's recent real anti-spoofing verdict.")
+recent_verdicts = RecentVerdicts(ttl=LIVENESS_REUSE_SECONDS)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.timings = {}
+
+# --- Readiness ---
+# initialize_backend() fills this in; /readyz reports it. Requests that need
+# the models or the gallery get a 503 until startup has finished.
+startup = {"state": "starting", "seconds": None, "components": {}}
+STARTUP_EXEMPT_ENDPOINTS = {"healthz", "readyz", "get_metrics", "static"}
+
+@app.before_request
+def reject_until_ready():
+    if startup["state"] == "starting" and request.endpoint not in STARTUP_EXEMPT_ENDPOINTS:
+        response = jsonify({"error": "Server is starting up. Please retry shortly."})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+metrics.Gauge("face_startup_seconds", "Seconds initialize_backend() took (0 while starting).", lambda: startup["seconds"] or 0)
+
+@app.after_request
+def record_request_time(response):
+    elapsed = time.perf_counter() - g.request_start
+    request_seconds.observe(elapsed, endpoint=request.endpoint or "unknown")
+    if TIMING_HEADERS:
+        entries = [f"{stage};dur={ms:.2f}" for stage, ms in g.timings.items()]
+        entries.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers['Server-Timing'] = ", ".join(entries)
+    return response
+
+# --- Inference Scheduler ---
+# All model work for requests runs on the scheduler's worker thread(s).
+scheduler = InferenceScheduler(
+    analyze_frames,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+    max_wait_ms=INFERENCE_MAX_WAIT_MS,
+    queue_depth=INFERENCE_QUEUE_DEPTH,
+    workers=INFERENCE_WORKERS
+)
+metrics.Gauge("face_inference_queue_depth", "Requests waiting for the inference worker.", lambda: scheduler.depth)
+
+# --- Streaming Sessions ---
+# Model calls from sessions go through the same scheduler as /verify.
+def scheduled(fn):
+    return lambda *args: scheduler.call(fn, *args).result(timeout=INFERENCE_TIMEOUT)
+
+stream_sessions = SessionRegistry(max_sessions=STREAM_MAX_SESSIONS, ttl=STREAM_SESSION_TTL)
+stream_frames = metrics.Counter("face_stream_frames_total", "Frames received by streaming sessions, by outcome (processed, dropped).")
+metrics.Gauge("face_stream_sessions", "Open streaming sessions.", lambda: len(stream_sessions))
+
+def stream_video_file(session, video_path):
+    """
+    Feeds a session from a video file at the file's own frame rate, dropping
+    frames the session is too slow for, and closes the session at the end.
+    """
+    frames = FrameSource(video_path, drop_frames=True)
+    frames.start()
+    try:
+        while not session.closed:
+            item = frames.read(timeout=1)
+            if item is None:
+                if frames.ended:
+                    break
+                continue
+            try:
+                session.process(resize_image(item[1], MAX_IMAGE_SIZE))
+                stream_frames.inc(outcome="processed")
+            except queue.Full:
+                stream_frames.inc(outcome="dropped")
+    except Exception as e:
+        print(f"---!!! ERROR while streaming '{video_path}': {e} !!!---")
+    finally:
+        frames.stop()
+        stream_sessions.remove(session.id)
+
+def busy_response():
+    return jsonify({"error": "Server busy: the inference queue is full. Please retry shortly."}), 503
+
+def load_detector():
+    if DETECTOR_BACKEND != "skip":
+        DeepFace.build_model(DETECTOR_BACKEND, task="face_detector")
+    # One pass on a dummy image also builds the model's inference graph
+    detect_faces(np.zeros([100, 100, 3], dtype=np.uint8))
+
+def load_recognizer():
+    DeepFace.build_model(MODEL_NAME)
+    embed_face(np.zeros([100, 100, 3], dtype=np.uint8))
+
+def load_antispoof():
+    check_spoof(np.zeros([100, 100, 3], dtype=np.uint8), {'x': 0, 'y': 0, 'w': 100, 'h': 100})
+
+def startup_scan_needed():
+    if STARTUP_SYNC == "always":
+        return True
+    if STARTUP_SYNC == "never":
+        return False
+    # A snapshot whose embedding matrix is missing or unreadable loads without embeddings
+    return not store.snapshot_complete()
+
+def sync_shared_gallery(scan, wait_for_models):
+    """
+    Brings the store up to date and publishes the shared gallery if it is
+    missing or changed. Returns (images added, images removed).
+    """
+    added = removed = 0
+    # The first process to get here syncs and publishes; the rest find nothing to do
+    with shared_gallery.lock:
+        journal = os.path.exists(store.journal_path)
+        if scan or journal or not shared_gallery.exists():
+            store.load()
+            if scan:
+                wait_for_models()
+                added, removed = store.sync(embed_image_file)
+            elif journal:
+                store.compact()
+            if added or removed or not shared_gallery.exists():
+                shared_gallery.publish(store.items())
+                gallery_rebuilds.inc()
+    return added, removed
+
+def prepare_shared_gallery():
+    """
+    Syncs the store and publishes the shared gallery without serving.
+    gunicorn.conf.py runs this once before forking the workers, so a long
+    folder scan doesn't hold up (or time out) worker boot.
+    """
+    if not SHARED_GALLERY:
+        return
+    os.makedirs(DB_PATH, exist_ok=True)
+    scan = startup_scan_needed()
+
+    def wait_for_models():
+        load_detector()
+        load_recognizer()
+
+    added, removed = sync_shared_gallery(scan, wait_for_models)
+    if scan:
+        print(f"-> Shared gallery ready: {added} image(s) newly embedded, {removed} removed.")
+    else:
+        print("-> Shared gallery ready (folder scan skipped).")
+
+def load_gallery(wait_for_models):
+    """
+    Loads the embedding store and builds the searchable gallery. The database
+    folder is only scanned (after the models are loaded, since new images must
+    be embedded) when startup_scan_needed(); otherwise a pending journal is
+    folded into the snapshot. Then marks the catalog's embedded images.
+    """
+    scan = startup_scan_needed()
+    added = removed = 0
+    if SHARED_GALLERY:
+        added, removed = sync_shared_gallery(scan, wait_for_models)
+        # This worker only needs the shared memory map, not its own copy
+        store.records = {}
+        refresh_gallery()
+    else:
+        store.load()
+        if scan:
+            wait_for_models()
+            added, removed = store.sync(embed_image_file)
+        elif os.path.exists(store.journal_path):
+            store.compact()
+        matcher.rebuild(store.items())
+        gallery_rebuilds.inc()
+    images_embedded.inc(added)
+    if scan:
+        print(f"-> Embedding store ready: {len(matcher)} image(s), {added} newly embedded, {removed} removed.")
+    else:
+        print(f"-> Embedding store ready: {len(matcher)} image(s) (folder scan skipped).")
+
+    catalog.mark_embedded(shared_gallery.identities if SHARED_GALLERY else list(store.records))
+
+def load_catalog():
+    """
+    Builds the user catalog straight from the database folder, so users are
+    listed and /verify doesn't report an empty database even if the gallery
+    fails to load.
+    """
+    # One listing of the database folder; /register and /delete keep the catalog current from here on
+    catalog.rebuild()
+    print(f"-> User catalog ready: {len(catalog)} user(s).")
+
+def run_startup_step(component, fn):
+    """
+    Runs one startup step and records its duration and outcome for /readyz.
+    """
+    start = time.perf_counter()
+    try:
+        fn()
+        status = "ok"
+    except Exception as e:
+        print(f"---!!! WARNING: Could not load {component}: {e} !!!---")
+        status = f"failed: {e}"
+    seconds = time.perf_counter() - start
+    startup["components"][component] = {"status": status, "seconds": round(seconds, 3)}
+    print(f"-> {component}: {status} in {seconds:.2f}s")
+
 def initialize_backend():
     """
-    Initializes the backend by checking the database and pre-loading necessary models.
-    This function runs once at startup.
+    Initializes the backend: loads the models and the gallery, then marks the
+    server ready. This function runs once at startup.
     """
     print("-> Initializing backend...")
+    start = time.perf_counter()
 
     # --- Path and Verification ---
     db_path_abs = os.path.abspath(DB_PATH)
@@ -54,228 +987,253 @@ def initialize_backend():
         print(f"-> Database directory '{db_path_abs}' not found. Creating it.")
         os.makedirs(db_path_abs)
 
-    # --- Database Update Check ---
-    # This automatically forces a rebuild if new images are added.
-    print("-> Checking for database updates...")
-    try:
-        # Check only if there are subdirectories (users) in the database
-        if any(os.path.isdir(os.path.join(db_path_abs, i)) for i in os.listdir(db_path_abs)):
-            pkl_files = glob.glob(os.path.join(db_path_abs, "representations_*.pkl"))
-            if pkl_files:
-                pkl_file_path = pkl_files[0]
-                pkl_mod_time = os.path.getmtime(pkl_file_path)
-
-                image_extensions = ["*.jpg", "*.jpeg", "*.png"]
-                all_image_files = []
-                for ext in image_extensions:
-                    all_image_files.extend(glob.glob(os.path.join(db_path_abs, "**", ext), recursive=True))
-
-                if all_image_files: # Proceed only if images are found
-                    rebuild_needed = any(os.path.getmtime(img_path) > pkl_mod_time for img_path in all_image_files)
-
-                    if rebuild_needed:
-                        print(f"-> Detected database changes. Deleting '{os.path.basename(pkl_file_path)}' to force rebuild.")
-                        os.remove(pkl_file_path)
-            else:
-                print("-> No representations file (.pkl) found. A new one will be created on the first run.")
-        else:
-            print("-> Database is empty. Skippingpkl check.")
+    # --- User Catalog ---
+    run_startup_step("catalog", load_catalog)
 
-    except Exception as e:
-        print(f"---!!! WARNING: Could not check for database updates: {e} !!!---")
+    # --- Models and Gallery ---
+    # Each model is built and run once on a dummy image so the first request
+    # doesn't pay for it. The gallery loads alongside.
+    print(f"-> Loading models (detector: {DETECTOR_BACKEND}, recognition model: {MODEL_NAME}, anti-spoofing: Fasnet)...")
+    loaders = {"detector": load_detector, "recognizer": load_recognizer, "antispoof": load_antispoof}
+    with ThreadPoolExecutor(max_workers=len(loaders) if WARMUP_PARALLEL else 1) as pool:
+        futures = {component: pool.submit(run_startup_step, component, fn) for component, fn in loaders.items()}
 
-    # --- Pre-load DeepFace models for faster processing ---
-    print("-> Pre-loading AI models. This may take a moment...")
-    try:
-        # Use a dummy find operation to pre-load and cache the models
-        if any(os.path.isdir(os.path.join(db_path_abs, i)) for i in os.listdir(db_path_abs)):
-             DeepFace.find(
-                img_path=np.zeros([100, 100, 3], dtype=np.uint8),
-                db_path=DB_PATH,
-                enforce_detection=False,
-                silent=True
-            )
-        else:
-            print("-> Database empty. Skipping model pre-loading to avoid errors.")
-        print("-> Models loaded successfully.")
-    except Exception as e:
-        print(f"---!!! WARNING: Could not pre-load models: {e} !!!---")
+        def wait_for_models():
+            futures["detector"].result()
+            futures["recognizer"].result()
+
+        run_startup_step("gallery", lambda: load_gallery(wait_for_models))
+
+    scheduler.start()
+    startup["seconds"] = round(time.perf_counter() - start, 3)
+    failed = [component for component, result in startup["components"].items() if result["status"] != "ok"]
+    startup["state"] = "degraded" if failed else "ready"
+    if failed:
+        print(f"---!!! WARNING: Started in {startup['seconds']:.2f}s without: {', '.join(failed)} !!!---")
+    else:
+        print(f"-> Backend ready in {startup['seconds']:.2f}s.")
 
 
 @app.route('/register', methods=['POST'])
 def register_user():
     """
     API endpoint to register a new user or add a new face to an existing user.
+    Accepts JSON ('name' + base64 'image'), multipart form data ('name' field +
+    'image' file) or a raw image body with the name in the query string.
     """
-    if not request.json or 'image' not in request.json or 'name' not in request.json:
-        return jsonify({"error": "Bad Request: Missing 'image' or 'name' in JSON payload."}), 400
-
-    name = request.json['name']
-    image_b64 = request.json['image']
+    name = request_field('name')
+    image_data = request_image_data()
+    if not image_data or not name:
+        return jsonify({"error": "Bad Request: Missing 'image' or 'name' in request."}), 400
 
     # --- Input validation ---
     if not name or not re.match("^[a-zA-Z0-9_-]+$", name):
         return jsonify({"status": "Error", "message": "Invalid name. Use only letters, numbers, underscores, or hyphens."}), 400
 
-    # --- Create user directory (if it doesn't exist) ---
+    # --- Skip an image that is already stored (same bytes, same file name) ---
     user_dir = os.path.join(DB_PATH, name)
-    if not os.path.exists(user_dir):
-        os.makedirs(user_dir)
-
-    # --- Check for duplicate/spamming (Optional limit) ---
-    # existing_images = glob.glob(os.path.join(user_dir, "*"))
-    # if len(existing_images) >= 5:
-    #     return jsonify({"status": "Error", "message": "Max 5 images per user allowed."}), 400
-
+    filename = content_name(image_data)
+    if os.path.exists(os.path.join(user_dir, filename)):
+        duplicate_registrations.inc(kind="identical")
+        return jsonify({"status": "Duplicate", "message": f"This image is already registered for user {name}."}), 200
+
+    # --- Decode image ---
+    with span("decode", g.timings):
+        frame = decode_image(image_data)
+    if frame is None:
+        return jsonify({"status": "Error", "message": "Could not decode image."}), 400
+
+    created = not os.path.exists(user_dir)
     try:
-        # --- Decode image and save ---
-        image_data = base64.b64decode(image_b64)
-        nparr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        frame = resize_image(frame)
+        # --- Validate that there is a detectable face and embed it ---
+        # Runs on the inference worker so it doesn't contend with /verify batches
+        face = scheduler.call(register_face, frame, g.timings).result(timeout=INFERENCE_TIMEOUT)
 
-        # --- Validate that there is a detectable face ---
-        face_objs = DeepFace.extract_faces(
-            img_path=frame,
-            detector_backend="mtcnn",
-            enforce_detection=False
-        )
-
-        if not face_objs or face_objs[0]['confidence'] < 0.95:
+        if face is None:
              return jsonify({"status": "Error", "message": "No clear face detected. Please provide a better image."}), 200
+        face_obj, embedding = face
 
-        # --- Generate Unique Filename ---
-        # Instead of 'face.jpg', we use a UUID to ensure every image has a unique name
-        unique_filename = f"{uuid.uuid4()}.jpg"
-        output_path = os.path.join(user_dir, unique_filename)
+        # --- Skip a near-identical image of the same user ---
+        duplicate = find_duplicate(name, embedding)
+        if duplicate is not None:
+            duplicate_registrations.inc(kind="similar")
+            return jsonify({
+                "status": "Duplicate",
+                "message": f"A nearly identical image is already registered for user {name}.",
+                "similarity": round(duplicate[1] * 100, 2),
+            }), 200
 
-        cv2.imwrite(output_path, frame)
+        # --- Store the aligned face crop and its thumbnail ---
+        output_path = save_face_image(user_dir, filename, align_face(frame, face_obj['facial_area']))
 
         print(f"-> User '{name}' updated. New image saved to '{output_path}'.")
 
-        # Invalidate the pkl file to force a rebuild on the next verification
-        pkl_files = glob.glob(os.path.join(DB_PATH, "representations_*.pkl"))
-        if pkl_files:
-            os.remove(pkl_files[0])
-            print("-> Removed representations.pkl to force a rebuild.")
+        # Append the new face to the embedding store instead of forcing a rebuild
+        identity = os.path.join(name, filename)
+        gallery_add(identity, embedding)
+        catalog.add_image(name, filename, os.path.getsize(output_path))
 
         return jsonify({"status": "Success", "message": f"Image added for user {name} successfully!"}), 201
 
+    except queue.Full:
+        return busy_response()
     except Exception as e:
         print(f"---!!! ERROR during registration: {e} !!!---")
-        # Only remove directory if it is empty (meaning we just created it and failed)
-        if os.path.exists(user_dir) and not os.listdir(user_dir):
-            os.rmdir(user_dir)
+        # Only remove the directory if we just created it and failed
+        if created:
+            remove_face_image(user_dir, filename)
+            remove_thumbnails(user_dir)
+            if os.path.isdir(user_dir) and not os.listdir(user_dir):
+                os.rmdir(user_dir)
         return jsonify({"error": f"An internal server error occurred: {e}"}), 500
 
 @app.route('/verify', methods=['POST'])
 def verify_face():
     """
     API endpoint to verify a face from an image with a similarity threshold.
-    Expects a JSON payload with an 'image' key containing a base64 encoded string.
+    Accepts a raw image body, a multipart 'image' file, or a JSON payload with
+    an 'image' key containing a base64 encoded string.
+    With faces=all (query string, form field or JSON key) the response also
+    has a 'faces' list with a result and box for every detected face. A
+    'session' id lets consecutive frames of one client reuse a recent real
+    anti-spoofing verdict.
     """
-    if not request.json or 'image' not in request.json:
-        return jsonify({"error": "Bad Request: Missing 'image' in JSON payload."}), 400
+    image_data = request_image_data()
+    if not image_data:
+        return jsonify({"error": "Bad Request: Missing 'image' in request."}), 400
+    all_faces = request_field('faces') == 'all'
+    session = request_field('session')
 
     # Check if the database is empty before proceeding
-    if not any(os.path.isdir(os.path.join(DB_PATH, i)) for i in os.listdir(DB_PATH)):
+    refresh_gallery()
+    if not catalog:
         return jsonify({"status": "Error", "message": "Database is empty. Please register a user first."}), 200
 
     try:
-        # --- Decode the image from base64 ---
-        image_data = base64.b64decode(request.json['image'])
-        nparr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        frame = resize_image(frame) # Resize before processing
-
-        # --- Face Analysis and Recognition ---
-        face_objs = DeepFace.extract_faces(
-            img_path=frame,
-            detector_backend="mtcnn",
-            anti_spoofing=True,
-            enforce_detection=False
-        )
-
-        if not face_objs or face_objs[0]['confidence'] < 0.95:
-            return jsonify({"status": "Unverified", "message": "No face detected."}), 200
-
-        face_obj = face_objs[0]
-
-        if not face_obj['is_real']:
-            return jsonify({"status": "Failed", "message": "Spoof attempt detected."}), 200
-
-        # --- Face Recognition ---
-        facial_area = face_obj['facial_area']
-        x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
-        face_roi = frame[y:y+h, x:x+w]
+        # --- Decode the image ---
+        with span("decode", g.timings):
+            frame = decode_image(image_data)
+        if frame is None:
+            return jsonify({"status": "Error", "message": "Could not decode image."}), 400
+
+        # --- Face Analysis and Recognition (queued for the inference worker) ---
+        faces = scheduler.submit((frame, g.timings, session, all_faces)).result(timeout=INFERENCE_TIMEOUT)
+
+        result = image_result(faces)
+        if all_faces:
+            result['faces'] = faces
+        return jsonify(result), 200
+
+    except queue.Full:
+        return busy_response()
+    except Exception as e:
+        print(f"---!!! ERROR during verification: {e} !!!---")
+        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
 
-        # --- Define model and distance metric for consistency ---
-        model_name = "VGG-Face"
-        distance_metric = "cosine"
 
-        dfs = DeepFace.find(
-            img_path=face_roi,
-            db_path=DB_PATH,
-            model_name=model_name,
-            distance_metric=distance_metric,
-            enforce_detection=False,
-            silent=True
-        )
+@app.route('/verify/batch', methods=['POST'])
+def verify_faces_batch():
+    """
+    API endpoint to verify several images in one request.
+    Accepts multipart form data with several 'images' files, or a JSON payload
+    with an 'images' key containing a list of base64 encoded strings.
+    Returns one /verify-shaped result per image. With faces=all, images with
+    more than one face also get a 'faces' list with a result and box for
+    every face.
+    """
+    payload = request.get_json(silent=True)
+    all_faces = request_field('faces') == 'all'
+    if 'images' in request.files:
+        files = request.files.getlist('images')
+        if len(files) > MAX_BATCH_IMAGES:
+            return jsonify({"error": f"Bad Request: At most {MAX_BATCH_IMAGES} images per batch."}), 400
+        images = [file.read() for file in files]
+    elif isinstance(payload, dict) and isinstance(payload.get('images'), list):
+        if len(payload['images']) > MAX_BATCH_IMAGES:
+            return jsonify({"error": f"Bad Request: At most {MAX_BATCH_IMAGES} images per batch."}), 400
+        # Items that aren't valid base64 get a "Could not decode image." result
+        images = [decode_base64(image_b64) for image_b64 in payload['images']]
+    else:
+        return jsonify({"error": "Bad Request: Missing 'images' list in request."}), 400
 
-        if len(dfs) > 0 and not dfs[0].empty:
-            # --- Dynamically find the distance column ---
-            best_match = dfs[0].iloc[0]
-            identity = best_match['identity']
-
-            # The distance column is usually named 'model_name_metric', e.g., 'VGG-Face_cosine'
-            # This finds the correct column name dynamically.
-            distance_col_name = f"{model_name}_{distance_metric}"
-            if distance_col_name not in best_match.index:
-                 # Fallback for older deepface versions or different naming conventions
-                 distance_col_name = 'distance' # Some versions might use a generic 'distance' column
-                 if distance_col_name not in best_match.index:
-                      # If still not found, search for any column containing the metric name
-                      cols = [col for col in best_match.index if distance_metric in col]
-                      if not cols:
-                          raise ValueError("Could not find the distance metric column in the result.")
-                      distance_col_name = cols[0]
-
-            distance = best_match[distance_col_name]
-
-            # Convert cosine distance to a similarity percentage
-            similarity_percent = (1 - distance) * 100
-
-            if similarity_percent >= 50:
-                name = os.path.basename(os.path.dirname(identity))
-                return jsonify({
-                    "status": "Verified",
-                    "id": name,
-                    "similarity": f"{similarity_percent:.2f}%"
-                }), 200
-            else:
-                return jsonify({
-                    "status": "Unverified",
-                    "message": f"Verification failed: Similarity ({similarity_percent:.2f}%) is below the 50% threshold.",
-                    "similarity": f"{similarity_percent:.2f}%"
-                }), 200
-        else:
-            return jsonify({"status": "Unverified", "message": "Unknown person."}), 200
+    # Check if the database is empty before proceeding
+    refresh_gallery()
+    if not catalog:
+        return jsonify({"status": "Error", "message": "Database is empty. Please register a user first."}), 200
 
+    try:
+        # --- Queue every decodable image; the worker batches them together ---
+        with span("decode", g.timings):
+            frames = [decode_image(image_data) for image_data in images]
+        futures = [scheduler.submit((frame, g.timings, None, all_faces)) if frame is not None else None for frame in frames]
+
+        # --- Assemble per-image results in the /verify response shape ---
+        results = []
+        for future in futures:
+            if future is None:
+                results.append({"status": "Error", "message": "Could not decode image."})
+                continue
+            faces = future.result(timeout=INFERENCE_TIMEOUT)
+            result = image_result(faces)
+            if len(faces) > 1:
+                result['faces'] = faces
+            results.append(result)
+
+        return jsonify({"results": results}), 200
+
+    except queue.Full:
+        return busy_response()
     except Exception as e:
-        print(f"---!!! ERROR during verification: {e} !!!---")
+        print(f"---!!! ERROR during batch verification: {e} !!!---")
         return jsonify({"error": f"An internal server error occurred: {e}"}), 500
 
 
 # --- NEW USERS ENDPOINT ---
+def conditional_json(body):
+    """
+    Returns body as JSON with an ETag, or an empty 304 Not Modified if the
+    client's If-None-Match already names this exact body.
+    """
+    response = jsonify(body)
+    response.add_etag()
+    # Browsers may keep the response but must revalidate it on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/users', methods=['GET'])
 def get_users():
     """
-    API endpoint to get a list of all registered users.
+    API endpoint to get a list of all registered users, sorted by name.
+    With ?page=N (and optionally per_page) only that page is returned, along
+    with the image count, stored bytes and embedded image count of each user
+    on it.
     """
+    page = request.args.get('page', type=int)
+    per_page = request.args.get('per_page', default=USERS_PAGE_SIZE, type=int)
+    if (page is not None and page < 1) or not 1 <= per_page <= USERS_MAX_PAGE_SIZE:
+        return jsonify({"error": f"Bad Request: 'page' must be at least 1 and 'per_page' between 1 and {USERS_MAX_PAGE_SIZE}."}), 400
+
     try:
-        # List directories in DB_PATH, which correspond to user names
-        users = [d for d in os.listdir(DB_PATH) if os.path.isdir(os.path.join(DB_PATH, d))]
-        return jsonify({"users": users}), 200
+        # Served from the in-memory catalog instead of listing DB_PATH
+        refresh_gallery()
+        if page is None:
+            users = catalog.names()
+            body = {"users": users, "total": len(users)}
+        else:
+            users, total = catalog.page(page, per_page)
+            body = {
+                "users": users,
+                "total": total,
+                "page": page,
+                "per_page": per_page,
+                "pages": (total + per_page - 1) // per_page,
+                "details": {user: catalog.summary(user) for user in users},
+            }
+        if hasattr(matcher, "template_counts"):
+            # Identity templates per user (INDEX_MODE = "template")
+            counts = matcher.template_counts()
+            body["templates"] = {user: counts[user] for user in users if user in counts}
+        return conditional_json(body)
     except Exception as e:
         print(f"---!!! ERROR fetching users: {e} !!!---")
         return jsonify({"error": f"An internal server error occurred: {e}"}), 500
@@ -286,12 +1244,11 @@ def get_users():
 def delete_user():
     """
     API endpoint to delete a user from the database.
-    Expects a JSON payload with a 'name' key.
+    Expects a JSON payload (or form field) with a 'name' key.
     """
-    if not request.json or 'name' not in request.json:
-        return jsonify({"error": "Bad Request: Missing 'name' in JSON payload."}), 400
-
-    name = request.json['name']
+    name = request_field('name')
+    if not name:
+        return jsonify({"error": "Bad Request: Missing 'name' in request."}), 400
 
     # --- Input validation ---
     if not name or not re.match("^[a-zA-Z0-9_-]+$", name):
@@ -305,12 +1262,11 @@ def delete_user():
     try:
         # Remove the user's directory and all its contents
         shutil.rmtree(user_dir)
+        remove_thumbnails(user_dir)
 
-        # Invalidate the pkl file to force a rebuild on the next verification
-        pkl_files = glob.glob(os.path.join(DB_PATH, "representations_*.pkl"))
-        if pkl_files:
-            os.remove(pkl_files[0])
-            print("-> Removed representations.pkl to force a rebuild.")
+        # Drop the user's rows from the embedding store
+        gallery_remove_user(name)
+        catalog.remove_user(name)
 
         print(f"-> User '{name}' deleted successfully.")
         return jsonify({"status": "Success", "message": f"User '{name}' has been deleted."}), 200
@@ -324,26 +1280,21 @@ def delete_user():
 @app.route('/users/<name>/images', methods=['GET'])
 def get_user_images(name):
     """
-    API endpoint to list all image filenames for a specific user.
+    API endpoint to list all image filenames for a specific user, with their
+    total size in bytes and how many of them have an embedding.
     """
     # --- Input validation to prevent path traversal ---
     if not name or not re.match("^[a-zA-Z0-9_-]+$", name):
         return jsonify({"error": "Invalid user name."}), 400
 
-    user_dir = os.path.join(DB_PATH, name)
-
-    if not os.path.exists(user_dir):
+    refresh_gallery()
+    images = catalog.images(name)
+    if images is None:
         return jsonify({"error": "User not found."}), 404
 
     try:
-        # Get list of files (jpg, png, etc)
-        image_extensions = ['*.jpg', '*.jpeg', '*.png']
-        images = []
-        for ext in image_extensions:
-            # We only want the filename, not the full path
-            images.extend([os.path.basename(f) for f in glob.glob(os.path.join(user_dir, ext))])
-
-        return jsonify({"user": name, "images": images}), 200
+        summary = catalog.summary(name)
+        return conditional_json({"user": name, "images": images, "bytes": summary["bytes"], "embedded": summary["embedded"]})
     except Exception as e:
         return jsonify({"error": f"Error retrieving images: {e}"}), 500
 
@@ -352,7 +1303,9 @@ def get_user_images(name):
 def serve_user_image(name, filename):
     """
     API endpoint to serve the actual image file to the browser.
-    Usage in HTML: <img src="/database_files/john_doe/some-uuid.jpg">
+    Usage in HTML: <img src="/database_files/john_doe/some-hash.jpg">
+    With ?size=thumb the small thumbnail is served instead; thumbnails missing
+    for older images are created on first request.
     """
     # --- Input validation ---
     if not re.match("^[a-zA-Z0-9_-]+$", name):
@@ -363,11 +1316,148 @@ def serve_user_image(name, filename):
 
     # send_from_directory automatically handles security against path traversal
     try:
-        return send_from_directory(user_dir, filename)
+        if request.args.get('size') == 'thumb':
+            thumb = thumbnail_path(user_dir, filename)
+            if not os.path.exists(thumb) and os.path.isfile(os.path.join(user_dir, filename)):
+                image = cv2.imread(os.path.join(user_dir, filename))
+                if image is not None:
+                    save_thumbnail(user_dir, filename, image)
+            if os.path.exists(thumb):
+                # A stored file name always refers to the same image, so browsers may cache it
+                return send_from_directory(os.path.dirname(thumb), os.path.basename(thumb), max_age=86400)
+        return send_from_directory(user_dir, filename, max_age=86400)
     except Exception as e:
         return jsonify({"error": "File not found or access denied."}), 404
 
 
+@app.route('/stream', methods=['POST'])
+def create_stream():
+    """
+    Opens a streaming session. Frames are then POSTed to
+    /stream/<id>/frames and results read from /stream/<id>/events. With a JSON
+    'source' naming a video file in STREAM_VIDEO_DIR, the server reads the
+    frames from that file instead.
+    """
+    source = request_field('source')
+    video_path = None
+    if source:
+        video_dir = os.path.realpath(STREAM_VIDEO_DIR)
+        video_path = os.path.realpath(os.path.join(video_dir, source))
+        if os.path.commonpath([video_dir, video_path]) != video_dir or not os.path.isfile(video_path):
+            return jsonify({"error": f"Video '{source}' not found in the video directory."}), 404
+
+    session = stream_sessions.create(
+        detect_fn=scheduled(detect_boxes),
+        recognize_fn=scheduled(recognize_boxes),
+        detect_every=STREAM_DETECT_EVERY_N_FRAMES,
+        spoof_history=STREAM_SPOOF_HISTORY,
+        min_confidence=DETECTION_CONFIDENCE
+    )
+    if session is None:
+        return jsonify({"error": "Too many open streaming sessions. Please retry shortly."}), 503
+    scheduler.start()
+    if video_path:
+        threading.Thread(target=stream_video_file, args=(session, video_path), daemon=True).start()
+
+    return jsonify({
+        "session": session.id,
+        "frames": f"/stream/{session.id}/frames",
+        "events": f"/stream/{session.id}/events"
+    }), 201
+
+
+@app.route('/stream/<session_id>/frames', methods=['POST'])
+def push_stream_frame(session_id):
+    """
+    Processes one frame of a session (same image formats as /verify).
+    Answers 202 right away when the previous frame is still being processed;
+    that frame is dropped.
+    """
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown or expired streaming session."}), 404
+    image_data = request_image_data()
+    if not image_data:
+        return jsonify({"error": "Bad Request: Missing 'image' in request."}), 400
+
+    with span("decode", g.timings):
+        frame = decode_image(image_data)
+    if frame is None:
+        return jsonify({"status": "Error", "message": "Could not decode image."}), 400
+
+    try:
+        processed = session.process(frame)
+    except queue.Full:
+        processed = False
+    except Exception as e:
+        print(f"---!!! ERROR during stream processing: {e} !!!---")
+        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
+    stream_frames.inc(outcome="processed" if processed else "dropped")
+    stream_sessions.expire()
+    return jsonify({"status": "processed" if processed else "dropped"}), 202
+
+
+@app.route('/stream/<session_id>/events', methods=['GET'])
+def stream_events(session_id):
+    """
+    Server-sent events with the session's faces, sent whenever a face appears,
+    leaves or changes result. The stream ends when the session is closed.
+    """
+    session = stream_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown or expired streaming session."}), 404
+
+    def events():
+        version = 0
+        while True:
+            version, event = session.wait(version, STREAM_KEEPALIVE)
+            if event is not None:
+                yield f"data: {json.dumps(event)}\n\n"
+            elif session.closed:
+                yield "event: end\ndata: {}\n\n"
+                return
+            else:
+                # Keeps proxies from closing an idle connection and notices expired sessions
+                stream_sessions.expire()
+                yield ": keepalive\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/stream/<session_id>', methods=['DELETE'])
+def close_stream(session_id):
+    if stream_sessions.remove(session_id) is None:
+        return jsonify({"error": "Unknown or expired streaming session."}), 404
+    return jsonify({"status": "Success", "message": "Streaming session closed."}), 200
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness: 200 once the models and the gallery have loaded, 503 while
+    starting up or if a component failed to load. Reports startup time per
+    component.
+    """
+    body = {"status": startup["state"], "startup_seconds": startup["seconds"], "components": startup["components"]}
+    return jsonify(body), 200 if startup["state"] == "ready" else 503
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus endpoint: per-stage latency histograms, request latency and
+    counters for gallery rebuilds, spoof rejects and verification outcomes.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == '__main__':
-    initialize_backend()
+    # Serve right away so /healthz and /readyz answer while the models load
+    threading.Thread(target=initialize_backend, daemon=True).start()
     app.run(host='0.0.0.0', port=5000)
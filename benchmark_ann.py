@@ -0,0 +1,121 @@
+# benchmark_ann.py
+# Compares the IVF index against exact search on a synthetic gallery so that
+# IVF_NLIST / IVF_NPROBE can be picked with a known recall/latency trade-off.
+# With --templates it also measures identity-template search
+# (TEMPLATES_PER_USER / TEMPLATE_SHORTLIST).
+# Runs fully offline; no models or images are needed.
+#
+# Example:
+#   python benchmark_ann.py --size 100000 --dim 512 --nlist 256 --nprobe 4 8 16 32
+#   python benchmark_ann.py --images-per-user 20 --templates 1 3 --shortlist 1 5
+import argparse
+import json
+import time
+import numpy as np
+from matcher import GalleryMatcher, IVFMatcher, TemplateMatcher, l2_normalize
+
+
+def synthetic_gallery(size, dim, images_per_user, queries, noise, seed=0):
+    """
+    Builds clustered embeddings: each user has a random center and every image
+    (and probe) is that center plus noise, similar to real face embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    n_users = max(1, size // images_per_user)
+    centers = l2_normalize(rng.standard_normal((n_users, dim)))
+    owners = np.arange(size) % n_users
+    gallery = l2_normalize(centers[owners] + noise * rng.standard_normal((size, dim)) / np.sqrt(dim))
+    probe_owners = rng.integers(0, n_users, queries)
+    probes = l2_normalize(centers[probe_owners] + noise * rng.standard_normal((queries, dim)) / np.sqrt(dim))
+    items = [(f"user_{owner}/{i}.jpg", gallery[i]) for i, owner in enumerate(owners)]
+    return items, probes
+
+
+def time_searches(matcher, probes, k, **search_args):
+    latencies = []
+    results = []
+    for probe in probes:
+        start = time.perf_counter()
+        results.append(matcher.search(probe, k=k, **search_args))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+
+def recall(truth, found, k):
+    hits = 0
+    for expected, got in zip(truth, found):
+        hits += len({i for i, _ in expected[:k]} & {i for i, _ in got[:k]})
+    return hits / (len(truth) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of the IVF and template indexes against exact search.")
+    parser.add_argument("--size", type=int, default=100000, help="Number of gallery embeddings.")
+    parser.add_argument("--dim", type=int, default=512, help="Embedding dimensions (VGG-Face uses 4096).")
+    parser.add_argument("--images-per-user", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.6, help="Spread of a user's images around their center.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--templates", type=int, nargs="*", default=[], help="Templates per user to benchmark.")
+    parser.add_argument("--shortlist", type=int, nargs="+", default=[1, 5, 10], help="Users rescored per probe.")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    items, probes = synthetic_gallery(args.size, args.dim, args.images_per_user, args.queries, args.noise)
+
+    exact = GalleryMatcher()
+    exact.rebuild(items)
+    truth, exact_latency = time_searches(exact, probes, args.k)
+
+    start = time.perf_counter()
+    ivf = IVFMatcher(nlist=args.nlist, min_train_size=1)
+    ivf.rebuild(items)
+    build_seconds = time.perf_counter() - start
+
+    rows = [{
+        "index": "exact", "nprobe": None,
+        "recall@1": 1.0, f"recall@{args.k}": 1.0,
+        "p50_ms": float(np.percentile(exact_latency, 50)),
+        "p95_ms": float(np.percentile(exact_latency, 95)),
+    }]
+    for nprobe in args.nprobe:
+        found, latency = time_searches(ivf, probes, args.k, nprobe=nprobe)
+        rows.append({
+            "index": "ivf", "nprobe": nprobe,
+            "recall@1": recall(truth, found, 1), f"recall@{args.k}": recall(truth, found, args.k),
+            "p50_ms": float(np.percentile(latency, 50)),
+            "p95_ms": float(np.percentile(latency, 95)),
+        })
+
+    for templates_per_user in args.templates:
+        templates = TemplateMatcher(templates_per_user=templates_per_user)
+        templates.rebuild(items)
+        for shortlist in args.shortlist:
+            found, latency = time_searches(templates, probes, args.k, shortlist=shortlist)
+            rows.append({
+                "index": "template", "templates": templates_per_user, "shortlist": shortlist,
+                "recall@1": recall(truth, found, 1), f"recall@{args.k}": recall(truth, found, args.k),
+                "p50_ms": float(np.percentile(latency, 50)),
+                "p95_ms": float(np.percentile(latency, 95)),
+            })
+
+    if args.json:
+        print(json.dumps({"size": args.size, "dim": args.dim, "nlist": args.nlist,
+                          "ivf_build_seconds": build_seconds, "results": rows}, indent=2))
+        return
+
+    print(f"Gallery: {args.size} x {args.dim}, nlist={args.nlist}, IVF build {build_seconds:.1f}s")
+    print(f"{'index':<8} {'setting':>12} {'recall@1':>9} {f'recall@{args.k}':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        if row["index"] == "template":
+            setting = f"t={row['templates']} s={row['shortlist']}"
+        else:
+            setting = "-" if row["nprobe"] is None else f"nprobe={row['nprobe']}"
+        print(f"{row['index']:<8} {setting:>12} {row['recall@1']:>9.3f} {row[f'recall@{args.k}']:>10.3f} "
+              f"{row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# benchmark_pipeline.py
+# Measures where time goes in /verify and /register: each stage of the
+# pipeline (decode, detection, anti-spoofing, crop, embedding, gallery search)
+# is timed through the app's own functions, and whole requests are replayed
+# through the Flask test client, for one or more synthetic gallery sizes.
+#
+# Runs offline against a temporary database; the real ./database is never
+# touched. Models must already be downloaded (python download_models.py), or
+# pass --synthetic-models to replace detection/embedding with trivial
+# functions and measure everything else (decode, search, HTTP, scheduling).
+#
+# Examples:
+#   python benchmark_pipeline.py --frames recorded_frames/ --gallery-sizes 1000 10000 100000
+#   python benchmark_pipeline.py --synthetic-models --json bench.json
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import cv2
+
+from benchmark_ann import synthetic_gallery
+
+
+def percentiles(samples_ms):
+    samples = np.array(samples_ms)
+    return {
+        "count": len(samples),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "throughput_per_s": float(1000 / samples.mean()) if samples.mean() > 0 else None,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def load_frames(frames_dir, count):
+    """
+    Reads recorded JPEG/PNG frames, or synthesizes webcam-sized frames if none are given.
+    """
+    frames = []
+    if frames_dir:
+        for ext in ("*.jpg", "*.jpeg", "*.png"):
+            for path in sorted(glob.glob(os.path.join(frames_dir, ext))):
+                with open(path, "rb") as f:
+                    frames.append(f.read())
+        if not frames:
+            sys.exit(f"No .jpg/.jpeg/.png frames found in '{frames_dir}'.")
+    else:
+        rng = np.random.default_rng(0)
+        for _ in range(count):
+            # Lightly smoothed noise: sharp enough to pass the liveness pre-filter's blur check
+            image = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (5, 5), 1)
+            frames.append(cv2.imencode(".jpg", image)[1].tobytes())
+    return frames
+
+
+def use_synthetic_models(app, dim):
+    """
+    Replaces detection and embedding with trivial functions so the benchmark
+    can run without model weights. Model time is then excluded from results.
+    """
+    def detect_faces(frame, timings=None):
+        h, w = frame.shape[:2]
+        return [{"facial_area": {"x": w // 4, "y": h // 4, "w": w // 2, "h": h // 2}, "confidence": 1.0}]
+
+    def embed_face(face_roi):
+        rng = np.random.default_rng(int(face_roi.mean() * 1000))
+        return rng.standard_normal(dim).astype(np.float32)
+
+    app.detect_faces = detect_faces
+    app.check_spoofs = lambda image, facial_areas: [(True, 1.0)] * len(facial_areas)
+    # Nothing to load at startup
+    app.load_detector = app.load_recognizer = app.load_antispoof = lambda: None
+    app.embed_face = embed_face
+    app.embed_faces = lambda face_rois: [embed_face(face_roi) for face_roi in face_rois]
+
+
+def bench_stages(app, frames, iterations):
+    """
+    Times each /verify stage through the app's own functions.
+    """
+    stages = {"decode": [], "detect": [], "antispoof": [], "crop": [], "embed": [], "match": []}
+    for i in range(iterations):
+        image_data = frames[i % len(frames)]
+        frame, ms = timed(app.decode_image, image_data)
+        stages["decode"].append(ms)
+
+        timings = {}
+        face_objs = app.detect_faces(frame, timings=timings)
+        if "detect" in timings:
+            stages["detect"].append(timings["detect"])
+        facial_areas = [face_obj["facial_area"] for face_obj in face_objs
+                        if face_obj["confidence"] >= app.DETECTION_CONFIDENCE]
+        if facial_areas:
+            _, ms = timed(app.check_spoofs, frame, facial_areas)
+            stages["antispoof"].append(ms)
+
+        if face_objs and face_objs[0]["confidence"] >= app.DETECTION_CONFIDENCE:
+            face_roi, ms = timed(app.crop_face, frame, face_objs[0])
+            stages["crop"].append(ms)
+        else:
+            # No face in this frame; embed a center crop so the stage is still measured
+            h, w = frame.shape[:2]
+            face_roi = frame[h // 4:3 * h // 4, w // 4:3 * w // 4]
+
+        embedding, ms = timed(app.embed_face, face_roi)
+        stages["embed"].append(ms)
+
+        _, ms = timed(app.matcher.search, embedding, k=1)
+        stages["match"].append(ms)
+    return {name: percentiles(samples) for name, samples in stages.items() if samples}
+
+
+def check_response(endpoint, response, statuses):
+    """
+    Stops the benchmark if a request didn't go through the pipeline, so error
+    responses (server not ready, empty database, ...) are never timed.
+    """
+    body = response.get_json(silent=True) or {}
+    if response.status_code not in statuses or body.get("status") == "Error":
+        sys.exit(f"{endpoint} returned {response.status_code}: {body}")
+
+
+def bench_requests(app, client, frames, iterations, register_iterations):
+    """
+    Replays frames as whole HTTP requests through the Flask test client.
+    """
+    verify = []
+    for i in range(iterations):
+        response, ms = timed(client.post, "/verify", data=frames[i % len(frames)], content_type="image/jpeg")
+        check_response("/verify", response, (200,))
+        verify.append(ms)
+
+    register = []
+    for i in range(register_iterations):
+        # A fresh user per request, so replayed frames aren't skipped as duplicates
+        response, ms = timed(client.post, f"/register?name=bench_register_{i}", data=frames[i % len(frames)], content_type="image/jpeg")
+        check_response("/register", response, (200, 201))
+        register.append(ms)
+    for i in range(register_iterations):
+        client.post("/delete", json={"name": f"bench_register_{i}"})
+
+    results = {"http_verify": percentiles(verify)}
+    if register:
+        results["http_register"] = percentiles(register)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency benchmark for the verify/register pipeline.")
+    parser.add_argument("--frames", help="Directory of recorded frames to replay. Synthetic frames are used if omitted.")
+    parser.add_argument("--gallery-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--iterations", type=int, default=50, help="Frames timed per stage and per gallery size.")
+    parser.add_argument("--register-iterations", type=int, default=10)
+    parser.add_argument("--synthetic-models", action="store_true", help="Skip real detection/embedding models.")
+    parser.add_argument("--dim", type=int, help="Embedding size for --synthetic-models (default: 512).")
+    parser.add_argument("--json", help="Write machine-readable results to this file ('-' for stdout).")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames, max(args.iterations, 1))
+    json_path = os.path.abspath(args.json) if args.json and args.json != "-" else args.json
+
+    # Run the app against a throwaway database so ./database is never touched
+    workdir = tempfile.mkdtemp(prefix="face-bench-")
+    os.chdir(workdir)
+    os.makedirs(os.path.join("database", "bench_user"))
+    import app
+
+    # Replayed frames repeat, so cached /verify results would be timed instead of the pipeline
+    app.PROBE_CACHE_TTL = 0
+    if args.synthetic_models:
+        use_synthetic_models(app, args.dim or 512)
+    # Loads the models and the (empty) store, builds the user catalog and marks the app ready
+    app.initialize_backend()
+    if app.startup["state"] != "ready":
+        sys.exit(f"Backend did not start: {app.startup['components']}")
+    dim = len(app.embed_face(np.zeros([100, 100, 3], dtype=np.uint8)))
+    client = app.app.test_client()
+
+    report = {
+        "model": app.MODEL_NAME,
+        "detector": app.DETECTOR_BACKEND,
+        "synthetic_models": args.synthetic_models,
+        "embedding_dim": dim,
+        "frames": len(frames),
+        "results": [],
+    }
+    for size in args.gallery_sizes:
+        print(f"-> Gallery of {size} embeddings...")
+        items, _ = synthetic_gallery(size, dim, images_per_user=5, queries=0, noise=0.6)
+        items = [(os.path.join("bench_user", identity.replace("/", "_")), embedding) for identity, embedding in items]
+        app.matcher.rebuild(items)
+
+        stages = bench_stages(app, frames, args.iterations)
+        stages.update(bench_requests(app, client, frames, args.iterations, args.register_iterations))
+        report["results"].append({"gallery_size": size, "stages": stages})
+
+    if json_path == "-":
+        print(json.dumps(report, indent=2))
+    else:
+        if json_path:
+            with open(json_path, "w") as f:
+                json.dump(report, f, indent=2)
+        print(f"\nModel {report['model']} ({dim}-d), detector {report['detector']}"
+              f"{' [synthetic models]' if args.synthetic_models else ''}, {len(frames)} frame(s)")
+        print(f"{'gallery':>8} {'stage':<17} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}")
+        for result in report["results"]:
+            for stage, stats in result["stages"].items():
+                print(f"{result['gallery_size']:>8} {stage:<17} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} "
+                      f"{stats['p99_ms']:>9.3f} {stats['throughput_per_s'] or 0:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
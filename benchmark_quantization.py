@@ -0,0 +1,137 @@
+# benchmark_quantization.py
+# Measures what quantized gallery storage buys against the float32 baseline on
+# a synthetic gallery: store load time and memory (legacy pickle snapshot vs
+# the array-backed snapshot, in RAM and memory-mapped), search memory, and the
+# accuracy/latency of float16, int8 and product-quantized search with and
+# without full-precision rescoring.
+# Runs fully offline; no models or images are needed.
+#
+# Example:
+#   python benchmark_quantization.py --size 20000 --dim 4096 --rescore 0 32
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from benchmark_ann import synthetic_gallery, time_searches, recall
+from embedding_store import EmbeddingStore
+from matcher import GalleryMatcher, QuantizedMatcher
+
+
+def measure(fn):
+    """
+    Returns (seconds, bytes allocated and still held) for fn. Timing and
+    memory come from separate runs, since tracing slows allocations down.
+    """
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, held
+
+
+def bench_store_load(items, workdir):
+    """
+    Load time and memory of the embedding store snapshot formats.
+    """
+    store = EmbeddingStore(workdir, "bench")
+    store.records = {identity: {"mtime": 0.0, "embedding": embedding} for identity, embedding in items}
+    store.compact()
+
+    legacy_dir = os.path.join(workdir, "legacy")
+    os.makedirs(legacy_dir)
+    legacy = EmbeddingStore(legacy_dir, "bench")
+    with open(legacy.snapshot_path, "wb") as f:
+        pickle.dump({
+            "model_name": "bench",
+            "identities": [identity for identity, _ in items],
+            "mtimes": [0.0] * len(items),
+            "embeddings": [np.array(embedding) for _, embedding in items],
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    results = {}
+    for name, path, mmap in (("pickle (legacy)", legacy_dir, False), ("array", workdir, False), ("array, mmap", workdir, True)):
+        loaded = EmbeddingStore(path, "bench", mmap=mmap)
+        seconds, held = measure(loaded.load)
+        results[name] = {"load_ms": seconds * 1000, "memory_mb": held / 2 ** 20}
+        del loaded
+    return store, results
+
+
+def bench_search(store_items, probes, k, rescore_values, pq_subvectors):
+    """
+    Memory, accuracy and latency of each precision against exact float32 search.
+    """
+    exact = GalleryMatcher()
+    exact.rebuild(store_items)
+    truth, latencies = time_searches(exact, probes, k)
+    results = [{
+        "precision": "float32", "rescore": 0, "memory_mb": exact.matrix.nbytes / 2 ** 20,
+        "recall@1": 1.0, f"recall@{k}": 1.0, "top1_error": 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95)),
+    }]
+
+    for precision in ("float16", "int8", "pq"):
+        matcher = QuantizedMatcher(precision, pq_subvectors=pq_subvectors, min_train_size=256)
+        matcher.rebuild(store_items)
+        for rescore in rescore_values:
+            found, latencies = time_searches(matcher, probes, k, rescore=rescore)
+            results.append({
+                "precision": precision,
+                "rescore": rescore,
+                "memory_mb": matcher.nbytes() / 2 ** 20,
+                "recall@1": recall(truth, found, 1),
+                f"recall@{k}": recall(truth, found, k),
+                "top1_error": float(np.mean([abs(t[0][1] - f[0][1]) for t, f in zip(truth, found)])),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory, load time and accuracy of quantized gallery storage.")
+    parser.add_argument("--size", type=int, default=20000, help="Number of gallery embeddings.")
+    parser.add_argument("--dim", type=int, default=4096, help="Embedding dimensions (VGG-Face uses 4096).")
+    parser.add_argument("--images-per-user", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.6, help="Spread of a user's images around their center.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[0, 32], help="Candidates rescored at full precision.")
+    parser.add_argument("--pq-subvectors", type=int, default=64)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results.")
+    args = parser.parse_args()
+
+    items, probes = synthetic_gallery(args.size, args.dim, args.images_per_user, args.queries, args.noise)
+    workdir = tempfile.mkdtemp(prefix="face-quant-")
+    try:
+        store, load_results = bench_store_load(items, workdir)
+        # Search over the store's own rows, as the app does
+        search_results = bench_search(store.items(), probes, args.k, args.rescore, args.pq_subvectors)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"size": args.size, "dim": args.dim, "store_load": load_results, "search": search_results}, indent=2))
+        return
+
+    print(f"Gallery: {args.size} x {args.dim}-d, {args.queries} queries")
+    print(f"\n{'store snapshot':<18} {'load ms':>9} {'RAM MB':>9}")
+    for name, result in load_results.items():
+        print(f"{name:<18} {result['load_ms']:>9.1f} {result['memory_mb']:>9.1f}")
+    print(f"\n{'precision':<10} {'rescore':>7} {'RAM MB':>9} {'recall@1':>9} {f'recall@{args.k}':>9} "
+          f"{'top1 err':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for result in search_results:
+        print(f"{result['precision']:<10} {result['rescore']:>7} {result['memory_mb']:>9.1f} {result['recall@1']:>9.3f} "
+              f"{result[f'recall@{args.k}']:>9.3f} {result['top1_error']:>9.4f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
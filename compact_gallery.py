@@ -0,0 +1,219 @@
+# compact_gallery.py
+# Rewrites an existing database the way /register now stores images: every
+# image that is not yet an aligned face crop (full frames saved by older
+# versions, unaligned crops from older enroll.py runs) is replaced by an
+# aligned crop named after a hash of its contents, every image gets a
+# thumbnail for the admin listing, and images nearly identical to an earlier
+# image of the same user (--similarity) are deleted. The embedding store is
+# updated in place, reusing the stored embedding of each rewritten image, so
+# only images missing from the store are embedded.
+#
+# Stop a single-process server (python app.py) while compacting and restart it
+# afterwards; with gunicorn (shared gallery) the workers pick up the new
+# gallery as soon as the command finishes.
+#
+# Examples:
+#   python compact_gallery.py --dry-run
+#   python compact_gallery.py --db ./database --similarity 0.97
+import argparse
+import os
+import re
+import sys
+import cv2
+import numpy as np
+
+from config import MODEL_NAME
+from embedding_store import EmbeddingStore, IMAGE_EXTENSIONS
+from face_images import (CROP_JPEG_QUALITY, STORED_NAME_PATTERN, align_face, content_name, remove_face_image,
+                         save_face_image, save_thumbnail, thumbnail_path)
+from shared_gallery import SharedGallery
+
+NAME_PATTERN = re.compile("^[a-zA-Z0-9_-]+$")
+
+
+def user_images(user_dir):
+    """
+    Returns the file names of a user's images, oldest first.
+    """
+    suffixes = tuple(ext.lstrip("*") for ext in IMAGE_EXTENSIONS)
+    filenames = [f for f in os.listdir(user_dir)
+                 if f.lower().endswith(suffixes) and os.path.isfile(os.path.join(user_dir, f))]
+    return sorted(filenames, key=lambda f: (os.path.getmtime(os.path.join(user_dir, f)), f))
+
+
+def normalized(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class Compaction:
+    """
+    Rewrites one user directory at a time and keeps the store in step.
+    """
+
+    def __init__(self, app, db_path, store, similarity, dry_run):
+        self.app = app
+        self.db_path = db_path
+        self.store = store
+        self.shared_gallery = SharedGallery(db_path, MODEL_NAME)
+        self.similarity = similarity
+        self.dry_run = dry_run
+        self.rewritten = 0
+        self.duplicates = 0
+        self.thumbnails = 0
+        self.failed = []
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def stored_embedding(self, identity, path):
+        """
+        Returns the store's embedding for an image if it is current, else None.
+        """
+        record = self.store.records.get(identity)
+        if record is None or record["mtime"] != os.path.getmtime(path):
+            return None
+        return record["embedding"]
+
+    def compact_user(self, name):
+        user_dir = os.path.join(self.db_path, name)
+        kept = []      # normalized embeddings of the images kept so far
+        removed = []   # identities to drop from the store
+        added = []     # (identity, embedding) to add to the store
+        for filename in user_images(user_dir):
+            path = os.path.join(user_dir, filename)
+            identity = os.path.join(name, filename)
+            size = os.path.getsize(path)
+            self.bytes_before += size
+            embedding = self.stored_embedding(identity, path)
+            stored = embedding is not None
+
+            if STORED_NAME_PATTERN.match(filename):
+                # Already an aligned crop
+                new_filename, crop = filename, None
+                if embedding is None:
+                    embedding = self.app.embed_image_file(path)
+            else:
+                with open(path, "rb") as f:
+                    image_data = f.read()
+                frame = self.app.decode_image(image_data)
+                face_obj = None if frame is None else self.app.detect_main_face(frame)
+                if face_obj is None:
+                    self.failed.append((identity, "no clear face"))
+                    self.bytes_after += size
+                    continue
+                if embedding is None:
+                    embedding = self.app.embed_face(self.app.crop_face(frame, face_obj))
+                new_filename = content_name(image_data)
+                crop = align_face(frame, face_obj['facial_area'])
+
+            if embedding is None:
+                self.failed.append((identity, "no clear face"))
+                self.bytes_after += size
+                continue
+
+            # Near-identical to an image kept earlier, or the same bytes already stored under the new name
+            vector = normalized(embedding)
+            duplicate = new_filename != filename and os.path.exists(os.path.join(user_dir, new_filename))
+            if kept and not duplicate:
+                duplicate = float(np.max(np.stack(kept) @ vector)) >= self.similarity
+            if duplicate:
+                self.duplicates += 1
+                if not self.dry_run:
+                    remove_face_image(user_dir, filename)
+                    removed.append(identity)
+                continue
+            kept.append(vector)
+
+            if crop is None:
+                self.bytes_after += size
+                if not stored and not self.dry_run:
+                    added.append((identity, embedding, os.path.getmtime(path)))
+                if not os.path.exists(thumbnail_path(user_dir, filename)):
+                    self.thumbnails += 1
+                    if not self.dry_run:
+                        image = cv2.imread(path)
+                        if image is not None:
+                            save_thumbnail(user_dir, filename, image)
+                continue
+
+            self.rewritten += 1
+            self.thumbnails += 1
+            if self.dry_run:
+                ok, encoded = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, CROP_JPEG_QUALITY])
+                self.bytes_after += len(encoded) if ok else size
+                continue
+            new_path = save_face_image(user_dir, new_filename, crop)
+            self.bytes_after += os.path.getsize(new_path)
+            remove_face_image(user_dir, filename)
+            removed.append(identity)
+            added.append((os.path.join(name, new_filename), embedding, os.path.getmtime(new_path)))
+
+        if removed or added:
+            with self.shared_gallery.lock:
+                for identity in removed:
+                    self.store.remove(identity)
+                self.store.add_many(added)
+
+    def finish(self):
+        """
+        Folds the journal into the snapshot and republishes the shared gallery.
+        """
+        if self.dry_run:
+            return
+        with self.shared_gallery.lock:
+            # Reload so registrations and deletions journaled by live workers while
+            # compacting are kept, not overwritten by the store loaded at startup
+            self.store.load()
+            self.store.compact()
+            if self.shared_gallery.exists():
+                self.shared_gallery.publish(self.store.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rewrite stored images as aligned face crops with thumbnails and drop near-duplicates.")
+    parser.add_argument("--db", default="./database", help="Database directory (default: ./database).")
+    parser.add_argument("--similarity", type=float, default=None,
+                        help="Cosine similarity at which a user's image counts as a duplicate of an earlier one "
+                             "(default: REGISTER_DUPLICATE_SIMILARITY in app.py; 1.0 keeps duplicates).")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change.")
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    if not os.path.isdir(db_path):
+        sys.exit(f"No database directory at '{db_path}'.")
+    import app
+    similarity = app.REGISTER_DUPLICATE_SIMILARITY if args.similarity is None else args.similarity
+    # A similarity above 1 can't be reached, so nothing counts as a duplicate
+    similarity = similarity if similarity < 1 else 2.0
+
+    store = EmbeddingStore(db_path, MODEL_NAME)
+    store.load()
+    compaction = Compaction(app, db_path, store, similarity, args.dry_run)
+
+    users = sorted(d for d in os.listdir(db_path) if NAME_PATTERN.match(d) and os.path.isdir(os.path.join(db_path, d)))
+    print(f"-> Compacting {len(users)} user(s){' (dry run)' if args.dry_run else ''}.")
+    try:
+        for number, name in enumerate(users, start=1):
+            compaction.compact_user(name)
+            if number % 50 == 0 or number == len(users):
+                print(f"-> {number}/{len(users)} user(s): {compaction.rewritten} image(s) rewritten, "
+                      f"{compaction.duplicates} duplicate(s) removed.")
+    except KeyboardInterrupt:
+        print("-> Interrupted. Run the same command again to continue.")
+    finally:
+        compaction.finish()
+
+    verb = "would be" if args.dry_run else "were"
+    print(f"-> {compaction.rewritten} image(s) {verb} rewritten as face crops, {compaction.duplicates} duplicate(s) "
+          f"{verb} removed and {compaction.thumbnails} thumbnail(s) {verb} created.")
+    print(f"-> Images: {compaction.bytes_before / 2 ** 20:.1f} MB before, {compaction.bytes_after / 2 ** 20:.1f} MB after.")
+    if compaction.failed:
+        print(f"-> {len(compaction.failed)} image(s) left unchanged:")
+        for identity, reason in compaction.failed[:20]:
+            print(f"   {identity}: {reason}")
+        if len(compaction.failed) > 20:
+            print(f"   ... and {len(compaction.failed) - 20} more")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+
+# --- Model Configuration ---
+# One place that selects the face detector and recognition model for the API
+# (registration, verification, warmup), download_models.py and the webcam
+# scripts. Every value can be overridden with an environment variable.
+#
+# Embeddings are stored per recognition model (embeddings_<model>.pkl), so
+# switching models re-embeds the database once instead of mixing vectors
+# from different models.
+
+# Recognition model. Options: VGG-Face, Facenet, Facenet512, OpenFace, DeepFace,
+# DeepID, ArcFace, Dlib, SFace, GhostFaceNet.
+# Facenet512 is much lighter than VGG-Face (512-d vs 4096-d embeddings).
+MODEL_NAME = os.environ.get("FACE_MODEL", "Facenet512")
+
+# Face detector. Options: opencv, ssd, dlib, mtcnn, retinaface, mediapipe,
+# yolov8, yunet, centerface. YuNet is fast on CPU; mtcnn is more robust but slow.
+DETECTOR_BACKEND = os.environ.get("FACE_DETECTOR", "yunet")
+
+# Minimum detector confidence for a face to count. Scores are not calibrated
+# the same way across detectors; OpenCV's Haar cascade reports 0 when it finds
+# nothing, so any positive score is accepted for it.
+DEFAULT_DETECTION_CONFIDENCE = {
+    "mtcnn": 0.95,
+    "retinaface": 0.95,
+    "yunet": 0.9,
+    "ssd": 0.9,
+    "opencv": 0.01,
+}
+DETECTION_CONFIDENCE = float(os.environ.get(
+    "FACE_DETECTION_CONFIDENCE",
+    DEFAULT_DETECTION_CONFIDENCE.get(DETECTOR_BACKEND, 0.9)
+))
+
+# Minimum cosine similarity (in percent) for a match. Defaults follow DeepFace's
+# own cosine distance thresholds per model; VGG-Face keeps this app's original 50%.
+DEFAULT_SIMILARITY_THRESHOLD = {
+    "VGG-Face": 50,
+    "Facenet": 60,
+    "Facenet512": 70,
+    "ArcFace": 32,
+    "SFace": 40,
+    "GhostFaceNet": 35,
+}
+SIMILARITY_THRESHOLD = float(os.environ.get(
+    "FACE_SIMILARITY_THRESHOLD",
+    DEFAULT_SIMILARITY_THRESHOLD.get(MODEL_NAME, 50)
+))
@@ -1,26 +1,29 @@
 # download_models.py
 from deepface import DeepFace
+from config import MODEL_NAME, DETECTOR_BACKEND
 
 print("--- Starting Model Download and Build Process ---")
 print("This may take several minutes depending on your internet connection.")
 print("The script will download models for face detection, recognition, and anti-spoofing.")
+print(f"Using recognition model '{MODEL_NAME}' and detector '{DETECTOR_BACKEND}' (see config.py).")
 
 try:
-    # 1. Build the VGG-Face model for recognition
-    print("\n[1/3] Building recognition model (VGG-Face)...")
-    DeepFace.build_model("VGG-Face")
-    print("VGG-Face model built successfully.")
+    # 1. Build the recognition model
+    print(f"\n[1/3] Building recognition model ({MODEL_NAME})...")
+    DeepFace.build_model(MODEL_NAME)
+    print(f"{MODEL_NAME} model built successfully.")
 
     # 2. Build a backend model for detection
-    print("\n[2/3] Building detector model (mtcnn)...")
-    DeepFace.build_model("mtcnn") # mtcnn is a robust detector
+    print(f"\n[2/3] Building detector model ({DETECTOR_BACKEND})...")
+    if DETECTOR_BACKEND != "skip":
+        DeepFace.build_model(DETECTOR_BACKEND, task="face_detector")
     print("Detector model built successfully.")
 
     # 3. Force the anti-spoofing model to build by running it on a dummy image
     print("\n[3/3] Building anti-spoofing model...")
     # This call will trigger the download and build of the anti-spoofing models
     dummy_image = "https://raw.githubusercontent.com/serengil/deepface/master/tests/dataset/img1.jpg"
-    DeepFace.extract_faces(img_path=dummy_image, anti_spoofing=True)
+    DeepFace.extract_faces(img_path=dummy_image, detector_backend=DETECTOR_BACKEND, anti_spoofing=True)
     print("Anti-spoofing model built successfully.")
 
     print("\n--- ALL MODELS ARE BUILT AND READY. You can now run the main script. ---")
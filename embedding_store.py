@@ -0,0 +1,263 @@
+import os
+import glob
+import pickle
+import threading
+import numpy as np
+
+# --- Embedding Store ---
+# Keeps one embedding per database image so that /register and /delete only
+# have to write the change instead of forcing DeepFace to re-embed the whole
+# database. The store lives next to the images as a snapshot plus an
+# append-only journal; the journal is folded back into the snapshot on startup.
+#
+# The snapshot is array-backed: embeddings_<model>.pkl only holds identities
+# and mtimes, and the embeddings are one float32 matrix in
+# embeddings_<model>.<generation>.npy that loads in a single read (or is
+# memory-mapped, so rows are only paged in when used). Each compaction writes a
+# new generation, so a matrix that is still mapped is never overwritten.
+
+IMAGE_EXTENSIONS = ["*.jpg", "*.jpeg", "*.png"]
+
+
+def model_slug(model_name):
+    """
+    Turns a model name such as 'VGG-Face' into a file-name friendly 'vgg_face'.
+    """
+    return model_name.lower().replace("-", "_")
+
+
+def user_of(identity):
+    """
+    Returns the user name for an identity path such as 'john_doe/some-uuid.jpg'.
+    """
+    return os.path.basename(os.path.dirname(identity))
+
+
+class EmbeddingStore:
+    """
+    Persistent mapping of image identity -> (mtime, embedding) for one model.
+    Identities are image paths relative to the database directory.
+    """
+
+    def __init__(self, db_path, model_name, mmap=False):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.mmap = mmap
+        self.base = os.path.join(db_path, f"embeddings_{model_slug(model_name)}")
+        self.snapshot_path = self.base + ".pkl"
+        self.journal_path = self.base + ".journal"
+        self.generation = 0
+        self.records = {}
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def items(self):
+        """
+        Returns a list of (identity, embedding) pairs.
+        """
+        with self.lock:
+            return [(identity, record["embedding"]) for identity, record in self.records.items()]
+
+    def users(self):
+        with self.lock:
+            return sorted({user_of(identity) for identity in self.records})
+
+    # --- Persistence ---
+
+    def _matrix_path(self, generation):
+        return f"{self.base}.{generation}.npy"
+
+    def _load_matrix(self, generation):
+        # asarray: rows of a plain ndarray view are much cheaper to create than np.memmap rows
+        return np.asarray(np.load(self._matrix_path(generation), mmap_mode="r" if self.mmap else None))
+
+    def snapshot_complete(self):
+        """
+        Returns whether the snapshot exists and its embedding matrix can be
+        read with one row per identity. Only the matrix header is read.
+        """
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+            if "embeddings" in snapshot:
+                return True
+            matrix = np.load(self._matrix_path(snapshot["generation"]), mmap_mode="r")
+            return len(matrix) == len(snapshot["identities"])
+        except Exception:
+            return False
+
+    def load(self):
+        """
+        Loads the snapshot and replays any journal entries written after it.
+        """
+        with self.lock:
+            self.records = {}
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, "rb") as f:
+                    snapshot = pickle.load(f)
+                if "embeddings" in snapshot:
+                    # Snapshot written before the array-backed format; rewritten on the next compaction
+                    embeddings = snapshot["embeddings"]
+                else:
+                    self.generation = snapshot["generation"]
+                    try:
+                        embeddings = self._load_matrix(self.generation)
+                    except (OSError, ValueError) as e:
+                        print(f"---!!! WARNING: Could not read the embedding matrix, images will be re-embedded: {e} !!!---")
+                        embeddings = []
+                for identity, mtime, embedding in zip(snapshot["identities"], snapshot["mtimes"], embeddings):
+                    self.records[identity] = {"mtime": mtime, "embedding": embedding}
+
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "rb") as f:
+                    while True:
+                        try:
+                            entry = pickle.load(f)
+                        except EOFError:
+                            break
+                        except Exception as e:
+                            # A crash in the middle of an append leaves a truncated tail; everything before it is valid.
+                            print(f"---!!! WARNING: Ignoring truncated embedding journal entry: {e} !!!---")
+                            break
+                        self._apply(entry)
+
+    def compact(self):
+        """
+        Writes all records to a fresh snapshot generation and clears the journal.
+        """
+        with self.lock:
+            identities = list(self.records)
+            dim = len(self.records[identities[0]]["embedding"]) if identities else 0
+            generation = self.generation + 1
+
+            # Rows are copied one by one so a memory-mapped store never has to be read into RAM at once
+            matrix = np.lib.format.open_memmap(self._matrix_path(generation), mode="w+", dtype=np.float32,
+                                               shape=(len(identities), dim))
+            for row, identity in enumerate(identities):
+                matrix[row] = self.records[identity]["embedding"]
+            matrix.flush()
+            del matrix
+
+            snapshot = {
+                "model_name": self.model_name,
+                "generation": generation,
+                "identities": identities,
+                "mtimes": [self.records[i]["mtime"] for i in identities],
+            }
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+            # Point the records at the new matrix so the previous generation can be removed
+            self.generation = generation
+            matrix = self._load_matrix(generation)
+            for row, identity in enumerate(identities):
+                self.records[identity]["embedding"] = matrix[row]
+            self._remove_old_generations()
+
+    def _remove_old_generations(self):
+        current = self._matrix_path(self.generation)
+        for path in glob.glob(self.base + ".*.npy"):
+            if path != current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still mapped on platforms that forbid this; retried after the next compaction
+                    pass
+
+    def _append(self, *entries):
+        with open(self.journal_path, "ab") as f:
+            for entry in entries:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _apply(self, entry):
+        op = entry[0]
+        if op == "add":
+            _, identity, mtime, embedding = entry
+            self.records[identity] = {"mtime": mtime, "embedding": embedding}
+        elif op == "remove":
+            self.records.pop(entry[1], None)
+        elif op == "remove_user":
+            for identity in [i for i in self.records if user_of(i) == entry[1]]:
+                del self.records[identity]
+
+    # --- Incremental Updates ---
+
+    def add(self, identity, embedding, mtime=None):
+        """
+        Adds (or replaces) the embedding for a single image and journals it.
+        """
+        if mtime is None:
+            mtime = os.path.getmtime(os.path.join(self.db_path, identity))
+        entry = ("add", identity, mtime, np.asarray(embedding, dtype=np.float32))
+        with self.lock:
+            self._apply(entry)
+            self._append(entry)
+
+    def add_many(self, items):
+        """
+        Adds several (identity, embedding, mtime) records with one journal write.
+        """
+        entries = [("add", identity, mtime, np.asarray(embedding, dtype=np.float32)) for identity, embedding, mtime in items]
+        with self.lock:
+            for entry in entries:
+                self._apply(entry)
+            self._append(*entries)
+
+    def remove(self, identity):
+        entry = ("remove", identity)
+        with self.lock:
+            self._apply(entry)
+            self._append(entry)
+
+    def remove_user(self, name):
+        """
+        Drops every embedding belonging to the given user.
+        """
+        entry = ("remove_user", name)
+        with self.lock:
+            self._apply(entry)
+            self._append(entry)
+
+    def sync(self, embed_fn):
+        """
+        Brings the store in line with the images on disk. Only images whose
+        path/mtime are missing from the store are passed to embed_fn, which
+        takes an absolute image path and returns an embedding (or None to skip).
+        Returns (added, removed) counts.
+        """
+        on_disk = {}
+        for ext in IMAGE_EXTENSIONS:
+            for path in glob.glob(os.path.join(self.db_path, "*", ext)):
+                identity = os.path.relpath(path, self.db_path)
+                on_disk[identity] = os.path.getmtime(path)
+
+        with self.lock:
+            stale = [i for i in self.records if i not in on_disk]
+            for identity in stale:
+                del self.records[identity]
+
+            missing = [i for i, mtime in on_disk.items()
+                       if i not in self.records or self.records[i]["mtime"] != mtime]
+
+        added = 0
+        for identity in missing:
+            try:
+                embedding = embed_fn(os.path.join(self.db_path, identity))
+            except Exception as e:
+                print(f"---!!! WARNING: Could not embed '{identity}': {e} !!!---")
+                continue
+            if embedding is None:
+                continue
+            with self.lock:
+                self.records[identity] = {"mtime": on_disk[identity], "embedding": np.asarray(embedding, dtype=np.float32)}
+            added += 1
+
+        if added or stale or os.path.exists(self.journal_path) or not os.path.exists(self.snapshot_path):
+            self.compact()
+        return added, len(stale)
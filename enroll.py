@@ -0,0 +1,307 @@
+# enroll.py
+# Bulk-enrolls users straight into the gallery without going through
+# /register one image at a time. Images are read from a folder tree
+# (<root>/<name>/.../*.jpg) or a CSV with 'name' and 'path' columns, and
+# detection + embedding run in batches across a pool of worker processes.
+# Each accepted image is stored as an aligned face crop with a thumbnail in
+# <db>/<name>/ (face_images.py) and its embedding goes directly into the
+# embedding store; images that fail are listed with the reason in a
+# rejected-images report.
+#
+# The import is resumable: every processed source image is recorded in
+# <db>/enroll_<model>.progress, and re-running the same command skips those
+# images. Crop file names are derived from the source image's contents, so an
+# image that was stored but not yet recorded when the import stopped is simply
+# replaced, and identical source images of one user are stored once.
+#
+# Stop a single-process server (python app.py) during the import, or restart
+# it afterwards; with gunicorn (shared gallery) the workers pick up the new
+# gallery as soon as the import finishes.
+#
+# Examples:
+#   python enroll.py /data/directory_photos --workers 4
+#   python enroll.py --csv people.csv --report rejected.csv
+import argparse
+import csv
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import cv2
+
+from config import MODEL_NAME
+from embedding_store import EmbeddingStore, IMAGE_EXTENSIONS, model_slug
+from face_images import CROP_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY, align_face, content_name, make_thumbnail, thumbnail_path
+from shared_gallery import SharedGallery
+
+NAME_PATTERN = re.compile("^[a-zA-Z0-9_-]+$")
+
+
+# --- Input ---
+
+def walk_folder(root):
+    """
+    Yields (name, path) for every image under root/<name>/, in a stable order.
+    """
+    suffixes = tuple(ext.lstrip("*") for ext in IMAGE_EXTENSIONS)
+    for name in sorted(os.listdir(root)):
+        user_dir = os.path.join(root, name)
+        if not os.path.isdir(user_dir):
+            continue
+        for dirpath, dirnames, filenames in os.walk(user_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(suffixes):
+                    yield name, os.path.abspath(os.path.join(dirpath, filename))
+
+
+def read_csv(csv_path):
+    """
+    Yields (name, path) from a CSV with 'name' and 'path' columns. Relative
+    paths are resolved against the CSV file's directory.
+    """
+    base = os.path.dirname(os.path.abspath(csv_path))
+    with open(csv_path, newline="") as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or not {"name", "path"} <= set(reader.fieldnames):
+            sys.exit(f"'{csv_path}' needs a header row with 'name' and 'path' columns.")
+        for row in reader:
+            yield row["name"].strip(), os.path.abspath(os.path.join(base, row["path"].strip()))
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Worker Process ---
+
+_app = None
+
+
+def init_worker():
+    """
+    Loads the models once per worker process.
+    """
+    global _app
+    import app
+    _app = app
+
+
+def process_batch(batch):
+    """
+    Detects and embeds one batch of (name, path) images. Returns one result
+    dict per image: accepted ones carry the encoded crop, thumbnail and
+    embedding, rejected ones a reason.
+    """
+    app = _app
+    results, faces = [], []
+    for name, path in batch:
+        result = {"name": name, "path": path}
+        results.append(result)
+        if not NAME_PATTERN.match(name):
+            result["reason"] = "invalid name"
+            continue
+        try:
+            with open(path, "rb") as f:
+                image_data = f.read()
+            frame = app.decode_image(image_data)
+        except OSError as e:
+            result["reason"] = f"unreadable: {e.strerror}"
+            continue
+        if frame is None:
+            result["reason"] = "not a valid image"
+            continue
+
+        face_objs = [face_obj for face_obj in app.detect_faces(frame)
+                     if face_obj['confidence'] >= app.DETECTION_CONFIDENCE]
+        if not face_objs:
+            result["reason"] = "no clear face"
+            continue
+        if len(face_objs) > 1:
+            result["reason"] = f"{len(face_objs)} faces"
+            continue
+
+        crop = align_face(frame, face_objs[0]['facial_area'])
+        ok, encoded = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, CROP_JPEG_QUALITY])
+        ok_thumb, encoded_thumb = cv2.imencode(".jpg", make_thumbnail(crop), [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY])
+        if not (ok and ok_thumb):
+            result["reason"] = "could not encode crop"
+            continue
+        result["filename"] = content_name(image_data)
+        result["crop"] = encoded.tobytes()
+        result["thumbnail"] = encoded_thumb.tobytes()
+        faces.append((result, app.crop_face(frame, face_objs[0])))
+
+    if faces:
+        try:
+            embeddings = app.embed_faces([face_roi for _, face_roi in faces])
+        except Exception as e:
+            for result, _ in faces:
+                result.pop("crop")
+                result.pop("thumbnail")
+                result["reason"] = f"embedding failed: {e}"
+            return results
+        for (result, _), embedding in zip(faces, embeddings):
+            result["embedding"] = embedding
+    return results
+
+
+# --- Main Process ---
+
+class Enrollment:
+    """
+    Writes worker results into the database, the store and the progress log.
+    """
+
+    def __init__(self, db_path, store, report_path):
+        self.db_path = db_path
+        self.store = store
+        self.shared_gallery = SharedGallery(db_path, MODEL_NAME)
+        self.progress_path = os.path.join(db_path, f"enroll_{model_slug(MODEL_NAME)}.progress")
+        self.report_path = report_path
+        self.accepted = 0
+        self.rejected = 0
+
+    def completed(self, retry_rejected=False):
+        """
+        Returns the source paths already handled by earlier runs.
+        """
+        done = set()
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                for line in f:
+                    status, _, path = line.rstrip("\n").partition("\t")
+                    if path and (status == "accepted" or not retry_rejected):
+                        done.add(path)
+        return done
+
+    def save(self, results):
+        records = []
+        for result in results:
+            if "embedding" not in result:
+                continue
+            user_dir = os.path.join(self.db_path, result["name"])
+            # Stable per source image, so a resumed import overwrites instead of duplicating
+            filename = result["filename"]
+            output_path = os.path.join(user_dir, filename)
+            thumb_path = thumbnail_path(user_dir, filename)
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            with open(thumb_path, "wb") as f:
+                f.write(result["thumbnail"])
+            with open(output_path, "wb") as f:
+                f.write(result["crop"])
+            records.append((os.path.join(result["name"], filename), result["embedding"], os.path.getmtime(output_path)))
+
+        with self.shared_gallery.lock:
+            if records:
+                self.store.add_many(records)
+
+        rejected = [result for result in results if "embedding" not in result]
+        if rejected:
+            new_report = not os.path.exists(self.report_path)
+            with open(self.report_path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if new_report:
+                    writer.writerow(["name", "path", "reason"])
+                for result in rejected:
+                    writer.writerow([result["name"], result["path"], result["reason"]])
+
+        with open(self.progress_path, "a") as f:
+            for result in results:
+                f.write(f"{'accepted' if 'embedding' in result else 'rejected'}\t{result['path']}\n")
+        self.accepted += len(records)
+        self.rejected += len(rejected)
+
+    def finish(self):
+        """
+        Folds the journal into the snapshot and republishes the shared gallery.
+        """
+        with self.shared_gallery.lock:
+            # Workers may have registered or deleted users during the import. Their
+            # changes are only in the journal, after or between this run's own entries,
+            # so reload before compacting instead of writing the store loaded at startup.
+            self.store.load()
+            self.store.compact()
+            if self.shared_gallery.exists():
+                self.shared_gallery.publish(self.store.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-enroll face images into the gallery.")
+    parser.add_argument("folder", nargs="?", help="Folder with one sub-folder of images per user.")
+    parser.add_argument("--csv", help="CSV file with 'name' and 'path' columns (instead of a folder).")
+    parser.add_argument("--db", default="./database", help="Database directory (default: ./database).")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Worker processes, each with its own models (0: run in this process).")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per embedding batch.")
+    parser.add_argument("--report", default="enroll_rejected.csv", help="CSV report of rejected images.")
+    parser.add_argument("--retry-rejected", action="store_true", help="Process images rejected by an earlier run again.")
+    args = parser.parse_args()
+    if bool(args.folder) == bool(args.csv):
+        parser.error("give either a folder or --csv")
+
+    db_path = os.path.abspath(args.db)
+    os.makedirs(db_path, exist_ok=True)
+    store = EmbeddingStore(db_path, MODEL_NAME)
+    store.load()
+    enrollment = Enrollment(db_path, store, args.report)
+
+    sources = read_csv(args.csv) if args.csv else walk_folder(args.folder)
+    done = enrollment.completed(args.retry_rejected)
+    pending = [(name, path) for name, path in sources if path not in done]
+    print(f"-> {len(pending)} image(s) to enroll, {len(done)} already done.")
+    if not pending:
+        return
+
+    batches = batched(pending, args.batch_size)
+    start = time.perf_counter()
+
+    def report_progress():
+        processed = enrollment.accepted + enrollment.rejected
+        rate = processed / max(time.perf_counter() - start, 1e-6)
+        print(f"-> {processed}/{len(pending)} processed ({enrollment.accepted} accepted, "
+              f"{enrollment.rejected} rejected), {rate:.1f} images/s")
+
+    try:
+        if args.workers == 0:
+            init_worker()
+            for batch in batches:
+                enrollment.save(process_batch(batch))
+                report_progress()
+        else:
+            # spawn: each worker loads its own TensorFlow/PyTorch models from scratch
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(args.workers, mp_context=context, initializer=init_worker) as pool:
+                in_flight = set()
+                for batch in batches:
+                    in_flight.add(pool.submit(process_batch, batch))
+                    # Keep the pool busy without holding every result in memory
+                    if len(in_flight) >= 2 * args.workers:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            enrollment.save(future.result())
+                        report_progress()
+                for future in in_flight:
+                    enrollment.save(future.result())
+                report_progress()
+    except KeyboardInterrupt:
+        print("-> Interrupted. Run the same command again to resume.")
+    finally:
+        enrollment.finish()
+
+    print(f"-> Done: {enrollment.accepted} accepted, {enrollment.rejected} rejected.")
+    if enrollment.rejected:
+        print(f"-> Rejected images are listed in '{os.path.abspath(args.report)}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import math
+import os
+import re
+import shutil
+import cv2
+
+# --- Stored Face Images ---
+# The database keeps an aligned face crop per registered image instead of the
+# uploaded frame, plus a small thumbnail in <db>_thumbs/<name>/ for the admin
+# listing. Thumbnails live outside the database folder because DeepFace.find
+# (test.py, real_time_recognition.py) indexes every image under it. Crops keep some margin around the face so the store can still
+# re-detect and re-embed them. Files are named after a hash of the uploaded
+# (or source) image bytes, so the same image sent twice maps to the same file.
+
+# Extra space kept around the detected face in the stored crop, as a fraction
+# of the face size, so the crop can be re-detected if the store is rebuilt.
+CROP_MARGIN = 0.25
+CROP_JPEG_QUALITY = 92
+
+THUMBNAIL_SUFFIX = "_thumbs"  # <db>_thumbs/ sits next to the database folder
+THUMBNAIL_SIZE = 240
+THUMBNAIL_JPEG_QUALITY = 80
+
+# Names given by content_name(); anything else is an older full frame or crop
+STORED_NAME_PATTERN = re.compile("^[0-9a-f]{32}\\.jpg$")
+
+
+def content_name(image_data):
+    """
+    Returns the file name for an image from a hash of its encoded bytes.
+    """
+    return hashlib.sha256(image_data).hexdigest()[:32] + ".jpg"
+
+
+def expand_box(facial_area, shape, margin):
+    x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
+    dx, dy = int(w * margin), int(h * margin)
+    x0, y0 = max(0, x - dx), max(0, y - dy)
+    x1, y1 = min(shape[1], x + w + dx), min(shape[0], y + h + dy)
+    return x0, y0, x1, y1
+
+
+def align_face(frame, facial_area, margin=CROP_MARGIN):
+    """
+    Crops the face with `margin` around it, rotated so the eyes are level
+    when the detector returned eye landmarks.
+    """
+    x0, y0, x1, y1 = expand_box(facial_area, frame.shape, margin)
+    left_eye, right_eye = facial_area.get('left_eye'), facial_area.get('right_eye')
+    if left_eye is None or right_eye is None:
+        return frame[y0:y1, x0:x1].copy()
+
+    # Rotate a wider region so the corners of the final crop stay filled with image
+    rx0, ry0, rx1, ry1 = expand_box(facial_area, frame.shape, margin + 0.25)
+    region = frame[ry0:ry1, rx0:rx1]
+    (ex0, ey0), (ex1, ey1) = sorted([left_eye, right_eye])
+    angle = math.degrees(math.atan2(ey1 - ey0, ex1 - ex0))
+    center = ((ex0 + ex1) / 2 - rx0, (ey0 + ey1) / 2 - ry0)
+    rotation = cv2.getRotationMatrix2D(center, angle, 1.0)
+    region = cv2.warpAffine(region, rotation, (region.shape[1], region.shape[0]),
+                            flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return region[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0].copy()
+
+
+def make_thumbnail(image, max_size=THUMBNAIL_SIZE):
+    h, w = image.shape[:2]
+    scale = max_size / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def thumbnail_dir(user_dir):
+    """
+    Returns <db>_thumbs/<name> for the user directory <db>/<name>.
+    """
+    db_path, name = os.path.split(os.path.normpath(user_dir))
+    return os.path.join(db_path + THUMBNAIL_SUFFIX, name)
+
+
+def thumbnail_path(user_dir, filename):
+    return os.path.join(thumbnail_dir(user_dir), os.path.splitext(filename)[0] + ".jpg")
+
+
+def save_thumbnail(user_dir, filename, image):
+    """
+    Writes the thumbnail for a stored image and returns its path.
+    """
+    path = thumbnail_path(user_dir, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cv2.imwrite(path, make_thumbnail(image), [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY])
+    return path
+
+
+def save_face_image(user_dir, filename, crop):
+    """
+    Writes a face crop and its thumbnail. Returns the crop's path.
+    """
+    os.makedirs(user_dir, exist_ok=True)
+    path = os.path.join(user_dir, filename)
+    if not cv2.imwrite(path, crop, [cv2.IMWRITE_JPEG_QUALITY, CROP_JPEG_QUALITY]):
+        raise OSError(f"could not write '{path}'")
+    save_thumbnail(user_dir, filename, crop)
+    return path
+
+
+def remove_face_image(user_dir, filename):
+    """
+    Deletes a stored image and its thumbnail, if present.
+    """
+    for path in (os.path.join(user_dir, filename), thumbnail_path(user_dir, filename)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def remove_thumbnails(user_dir):
+    """
+    Deletes all thumbnails of a user.
+    """
+    shutil.rmtree(thumbnail_dir(user_dir), ignore_errors=True)
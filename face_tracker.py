@@ -0,0 +1,135 @@
+import itertools
+import numpy as np
+import cv2
+
+# --- Face Tracker ---
+# Lets the webcam scripts run the detector only every few frames and the
+# recognition model only when a face is new (or its identity is in doubt).
+# Between detections, boxes are moved with sparse optical flow; detections are
+# matched to existing tracks by IoU so each track keeps its cached identity.
+
+
+def iou(a, b):
+    """
+    Intersection over union of two (x, y, w, h) boxes.
+    """
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """
+    One tracked face and its cached recognition result.
+    """
+
+    def __init__(self, track_id, box, confidence):
+        self.id = track_id
+        self.box = box
+        self.confidence = confidence
+        self.label = None
+        self.color = (255, 255, 0)
+        self.known = False
+        self.last_recognized = None
+        self.misses = 0
+
+
+class FaceTracker:
+    """
+    IoU detection-to-track matching plus optical-flow box propagation.
+
+    A track needs recognition when it is new, when a detection matched to it
+    falls below `min_confidence` (having been above it), or when its last result was not a known
+    identity and `recheck_interval` frames have passed.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=2, min_confidence=0.9, recheck_interval=30):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_confidence = min_confidence
+        self.recheck_interval = recheck_interval
+        self.tracks = []
+        self.prev_gray = None
+        self.ids = itertools.count(1)
+
+    def update(self, detections, gray):
+        """
+        Matches (box, confidence) detections to tracks. Unmatched detections
+        start new tracks; tracks unmatched for more than max_misses detection
+        rounds are dropped.
+        """
+        pairs = sorted(
+            ((iou(track.box, box), t, d) for t, track in enumerate(self.tracks) for d, (box, _) in enumerate(detections)),
+            reverse=True
+        )
+        matched_tracks, matched_detections = set(), set()
+        for overlap, t, d in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or d in matched_detections:
+                continue
+            track = self.tracks[t]
+            box, confidence = detections[d]
+            if confidence < self.min_confidence <= track.confidence:
+                # Confidence just dropped: the cached identity may belong to someone else now
+                track.last_recognized = None
+            track.box, track.confidence = box, confidence
+            track.misses = 0
+            matched_tracks.add(t)
+            matched_detections.add(d)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        for d, (box, confidence) in enumerate(detections):
+            if d not in matched_detections:
+                self.tracks.append(Track(next(self.ids), box, confidence))
+
+        self.prev_gray = gray
+
+    def track(self, gray):
+        """
+        Moves every box by the median optical flow of corner points inside it.
+        """
+        if self.prev_gray is None:
+            self.prev_gray = gray
+            return
+        h, w = gray.shape[:2]
+        for track in self.tracks:
+            x, y, bw, bh = track.box
+            mask = np.zeros_like(self.prev_gray)
+            mask[max(0, y):min(h, y + bh), max(0, x):min(w, x + bw)] = 255
+            points = cv2.goodFeaturesToTrack(self.prev_gray, maxCorners=30, qualityLevel=0.01, minDistance=5, mask=mask)
+            if points is None:
+                continue
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, points, None)
+            good = status.ravel() == 1
+            if not good.any():
+                continue
+            dx, dy = np.median((moved[good] - points[good]).reshape(-1, 2), axis=0)
+            track.box = (int(round(x + dx)), int(round(y + dy)), bw, bh)
+        self.prev_gray = gray
+
+    def needs_recognition(self, frame_index):
+        """
+        Returns the tracks whose identity should be (re)computed on this frame.
+        """
+        due = []
+        for track in self.tracks:
+            if track.last_recognized is None:
+                due.append(track)
+            elif not track.known and frame_index - track.last_recognized >= self.recheck_interval:
+                due.append(track)
+        return due
+
+    def set_identity(self, track, label, color, known, frame_index):
+        track.label = label
+        track.color = color
+        track.known = known
+        track.last_recognized = frame_index
@@ -1,15 +1,301 @@
-from deepface import DeepFace
-import pandas as pd
+# find_person.py
+# Searches many probe images (e.g. CCTV stills) against the gallery at once,
+# or reports suspected duplicate enrollments.
+#
+# Search: every face in every probe image is detected and embedded in batches
+# across a pool of worker processes, then all probe embeddings are scored
+# against the stored gallery embeddings with chunked matrix-matrix products.
+# The top-k matches per face are written to CSV, or to Parquet when the output
+# file ends in .parquet (needs pandas and pyarrow).
+#
+# Duplicates (--duplicates): the gallery is compared against itself and every
+# pair of users with images at least --threshold percent similar is reported,
+# along with the most similar pair of images.
+#
+# Gallery embeddings are read from the embedding store in --db, so the server
+# does not need to run and only the probes are embedded.
+#
+# Examples:
+#   python find_person.py /data/cctv_stills --top-k 5 --output matches.csv
+#   python find_person.py --list stills.txt --output matches.parquet
+#   python find_person.py --duplicates --threshold 85 --output duplicates.csv
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
-try:
-    # df = DeepFace.find(img_path = "query_image.jpg", db_path = "database")
-    dfs = DeepFace.find(img_path="Yuzuru_Hanyu-Sochi_2014.jpg", db_path="./database", enforce_detection=False)
+from config import MODEL_NAME, SIMILARITY_THRESHOLD
+from embedding_store import EmbeddingStore, IMAGE_EXTENSIONS, user_of
+from matcher import chunked_top_k, similar_pairs
 
-    if dfs and not dfs[0].empty:
-        print("Found matching faces:")
-        print(dfs[0])
+SEARCH_FIELDS = ["probe", "face", "x", "y", "w", "h", "rank", "user", "identity", "similarity", "verified"]
+DUPLICATE_FIELDS = ["user_a", "user_b", "similarity", "image_pairs", "image_a", "image_b"]
+
+
+# --- Input ---
+
+def walk_images(root):
+    """
+    Yields the path of every image under root, in a stable order.
+    """
+    suffixes = tuple(ext.lstrip("*") for ext in IMAGE_EXTENSIONS)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(suffixes):
+                yield os.path.abspath(os.path.join(dirpath, filename))
+
+
+def read_list(list_path):
+    """
+    Yields the paths listed one per line. Relative paths are resolved against
+    the list file's directory.
+    """
+    base = os.path.dirname(os.path.abspath(list_path))
+    with open(list_path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield os.path.abspath(os.path.join(base, line))
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Worker Process ---
+
+_app = None
+
+
+def init_worker():
+    """
+    Loads the models once per worker process.
+    """
+    global _app
+    import app
+    _app = app
+
+
+def embed_batch(paths):
+    """
+    Detects and embeds every clear face in a batch of probe images. Returns
+    (faces, failures): faces are dicts with the probe path, face number, box
+    and embedding; failures are (path, reason) pairs.
+    """
+    app = _app
+    faces, crops, failures = [], [], []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                frame = app.decode_image(f.read())
+        except OSError as e:
+            failures.append((path, f"unreadable: {e.strerror}"))
+            continue
+        if frame is None:
+            failures.append((path, "not a valid image"))
+            continue
+
+        face_objs = [face_obj for face_obj in app.detect_faces(frame)
+                     if face_obj['confidence'] >= app.DETECTION_CONFIDENCE]
+        if not face_objs:
+            failures.append((path, "no clear face"))
+            continue
+        for number, face_obj in enumerate(face_objs):
+            facial_area = face_obj['facial_area']
+            faces.append({"probe": path, "face": number,
+                          **{key: int(facial_area[key]) for key in ('x', 'y', 'w', 'h')}})
+            crops.append(app.crop_face(frame, face_obj))
+
+    if crops:
+        try:
+            embeddings = app.embed_faces(crops)
+        except Exception as e:
+            failures.extend((path, f"embedding failed: {e}") for path in dict.fromkeys(face["probe"] for face in faces))
+            return [], failures
+        for face, embedding in zip(faces, embeddings):
+            face["embedding"] = embedding
+    return faces, failures
+
+
+def embed_probes(paths, workers, batch_size):
+    """
+    Embeds all probe images, in a pool of worker processes unless workers is 0.
+    """
+    faces, failures = [], []
+    start = time.perf_counter()
+
+    def collect(result):
+        faces.extend(result[0])
+        failures.extend(result[1])
+
+    def report_progress(done):
+        rate = done / max(time.perf_counter() - start, 1e-6)
+        print(f"-> {done}/{len(paths)} probe image(s) embedded, {len(faces)} face(s), {rate:.1f} images/s")
+
+    done = 0
+    batches = batched(paths, batch_size)
+    if workers == 0:
+        init_worker()
+        for batch in batches:
+            collect(embed_batch(batch))
+            done += len(batch)
+            report_progress(done)
+    else:
+        # spawn: each worker loads its own TensorFlow/PyTorch models from scratch
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker) as pool:
+            in_flight = {}
+            for batch in batches:
+                in_flight[pool.submit(embed_batch, batch)] = len(batch)
+                if len(in_flight) >= 2 * workers:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        collect(future.result())
+                        done += in_flight.pop(future)
+                    report_progress(done)
+            for future, count in in_flight.items():
+                collect(future.result())
+                done += count
+            report_progress(done)
+    return faces, failures
+
+
+# --- Search ---
+
+def search(faces, gallery, top_k, threshold, chunk_size):
+    """
+    Returns one output row per (probe face, rank).
+    """
+    identities = [identity for identity, _ in gallery]
+    indices, scores = chunked_top_k([face["embedding"] for face in faces], [embedding for _, embedding in gallery],
+                                    k=top_k, gallery_chunk=chunk_size)
+    rows = []
+    for face, face_indices, face_scores in zip(faces, indices, scores):
+        for rank, (index, score) in enumerate(zip(face_indices, face_scores), start=1):
+            similarity = round(float(score) * 100, 2)
+            rows.append({
+                **{key: face[key] for key in ("probe", "face", "x", "y", "w", "h")},
+                "rank": rank,
+                "user": user_of(identities[index]),
+                "identity": identities[index],
+                "similarity": similarity,
+                "verified": similarity >= threshold,
+            })
+    return rows
+
+
+def find_duplicates(gallery, threshold, chunk_size):
+    """
+    Returns one row per pair of different users with images at least
+    threshold percent similar, most similar first.
+    """
+    identities = [identity for identity, _ in gallery]
+    pairs = {}
+    for i, j, score in similar_pairs([embedding for _, embedding in gallery], threshold / 100, chunk_size):
+        user_i, user_j = user_of(identities[i]), user_of(identities[j])
+        if user_i == user_j:
+            continue
+        if user_i > user_j:
+            user_i, user_j, i, j = user_j, user_i, j, i
+        pair = pairs.setdefault((user_i, user_j), {"user_a": user_i, "user_b": user_j, "similarity": -1.0, "image_pairs": 0})
+        pair["image_pairs"] += 1
+        if score * 100 > pair["similarity"]:
+            pair.update(similarity=round(score * 100, 2), image_a=identities[i], image_b=identities[j])
+    return sorted(pairs.values(), key=lambda pair: -pair["similarity"])
+
+
+# --- Output ---
+
+def check_output(path):
+    """
+    Fails early, before any work, if a Parquet output cannot be written.
+    """
+    if path.lower().endswith(".parquet"):
+        try:
+            import pandas  # noqa: F401
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            sys.exit(f"Writing Parquet needs pandas and pyarrow ({e}). Use a .csv output instead.")
+
+
+def write_rows(path, fieldnames, rows):
+    if path.lower().endswith(".parquet"):
+        import pandas as pd
+        pd.DataFrame(rows, columns=fieldnames).to_parquet(path, index=False)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search probe images against the gallery, or find duplicate enrollments.")
+    parser.add_argument("probes", nargs="?", help="Probe image, or folder searched recursively for images.")
+    parser.add_argument("--list", help="Text file with one probe image path per line (instead of a folder).")
+    parser.add_argument("--duplicates", action="store_true", help="Report suspected duplicate users in the gallery.")
+    parser.add_argument("--db", default="./database", help="Database directory (default: ./database).")
+    parser.add_argument("--output", help="CSV or .parquet output (default: matches.csv / duplicates.csv).")
+    parser.add_argument("--top-k", type=int, default=5, help="Matches reported per probe face.")
+    parser.add_argument("--threshold", type=float, default=SIMILARITY_THRESHOLD,
+                        help=f"Similarity in percent to count as a match or duplicate (default: {SIMILARITY_THRESHOLD:g}).")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Worker processes, each with its own models (0: run in this process).")
+    parser.add_argument("--batch-size", type=int, default=16, help="Probe images per embedding batch.")
+    parser.add_argument("--chunk-size", type=int, default=16384, help="Gallery rows scored per block (bounds memory).")
+    args = parser.parse_args()
+    if args.duplicates == bool(args.probes or args.list) or (args.probes and args.list):
+        parser.error("give a probe folder/image, --list, or --duplicates")
+    output = args.output or ("duplicates.csv" if args.duplicates else "matches.csv")
+    check_output(output)
+
+    store = EmbeddingStore(os.path.abspath(args.db), MODEL_NAME, mmap=True)
+    store.load()
+    gallery = store.items()
+    if not gallery:
+        sys.exit(f"No {MODEL_NAME} embeddings in '{os.path.abspath(args.db)}'. Start the server or run enroll.py first.")
+    print(f"-> Gallery: {len(gallery)} image(s) of {len(store.users())} user(s).")
+
+    if args.duplicates:
+        rows = find_duplicates(gallery, args.threshold, min(args.chunk_size, 4096))
+        write_rows(output, DUPLICATE_FIELDS, rows)
+        print(f"-> {len(rows)} suspected duplicate user pair(s) written to '{os.path.abspath(output)}'.")
+        return
+
+    if args.list:
+        paths = list(read_list(args.list))
+    elif os.path.isdir(args.probes):
+        paths = list(walk_images(args.probes))
     else:
-        print("No matching faces found.")
+        paths = [os.path.abspath(args.probes)]
+    print(f"-> {len(paths)} probe image(s) to search.")
+
+    faces, failures = embed_probes(paths, args.workers, args.batch_size)
+    start = time.perf_counter()
+    rows = search(faces, gallery, args.top_k, args.threshold, args.chunk_size) if faces else []
+    print(f"-> Searched {len(faces)} face(s) in {time.perf_counter() - start:.2f}s.")
+
+    write_rows(output, SEARCH_FIELDS, rows)
+    verified = len({(row["probe"], row["face"]) for row in rows if row["verified"]})
+    print(f"-> {verified} of {len(faces)} face(s) matched a user; results written to '{os.path.abspath(output)}'.")
+    if failures:
+        print(f"-> {len(failures)} probe image(s) without a usable face:")
+        for path, reason in failures[:20]:
+            print(f"   {path}: {reason}")
+        if len(failures) > 20:
+            print(f"   ... and {len(failures) - 20} more")
+
 
-except Exception as e:
-    print(f"An error occurred: {e}")
+if __name__ == "__main__":
+    main()
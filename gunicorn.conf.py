@@ -0,0 +1,45 @@
+# gunicorn.conf.py
+# Production serving with several pre-forked worker processes:
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# Every worker loads its own detection/recognition models, but the gallery
+# matrix is shared: it is published to a memory-mapped file in the database
+# directory and each worker maps the same pages. When /register or /delete
+# changes the gallery in one worker, the others remap on their next request.
+import os
+import subprocess
+import sys
+import multiprocessing
+
+os.environ.setdefault("FACE_SHARED_GALLERY", "1")
+
+bind = os.environ.get("FACE_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("FACE_WORKERS", max(2, multiprocessing.cpu_count() // 2)))
+
+# Threads per worker let concurrent requests reach the inference scheduler
+# together so they can be micro-batched.
+worker_class = "gthread"
+threads = int(os.environ.get("FACE_THREADS", 8))
+
+# Model loading can take a while. Workers load before accepting connections;
+# the load balancer should check /readyz.
+timeout = 300
+
+
+def on_starting(server):
+    # Sync the store and publish the shared gallery once, before any worker
+    # boots, so a long folder scan doesn't count against `timeout`. It runs in
+    # a child process so the master never loads the models the workers would
+    # inherit on fork.
+    result = subprocess.run([sys.executable, "-c", "import app; app.prepare_shared_gallery()"])
+    if result.returncode == 0:
+        # Already scanned; workers only map the published gallery
+        os.environ["FACE_STARTUP_SYNC"] = "never"
+    else:
+        server.log.warning("Shared gallery sync failed; workers will sync on boot.")
+
+
+def post_worker_init(worker):
+    # Load models in the worker, after the fork, so each process owns its own
+    import app
+    app.initialize_backend()
@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# --- Inference Scheduler ---
+# HTTP handlers enqueue decoded frames instead of calling the models on their
+# own threads. A worker thread drains the queue, waits up to `max_wait_ms` for
+# more frames to form a batch, runs the batch function once and resolves each
+# request's future. Non-batchable model work (e.g. registration) can be run on
+# the same worker with `call`, so the models are only ever used from there.
+
+
+class InferenceScheduler:
+    """
+    Micro-batching queue in front of the detection/recognition models.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5, queue_depth=64, workers=1):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.batched_items = 0
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def start(self):
+        """
+        Starts the worker threads. Safe to call more than once.
+        """
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, item):
+        """
+        Queues one item for the batch function and returns a Future with its result.
+        Raises queue.Full when the queue is at capacity.
+        """
+        return self._enqueue("batch", item)
+
+    def call(self, fn, *args):
+        """
+        Runs fn(*args) on an inference worker, outside of any batch.
+        Raises queue.Full when the queue is at capacity.
+        """
+        return self._enqueue("call", (fn, args))
+
+    def _enqueue(self, kind, payload):
+        self.start()
+        future = Future()
+        self.queue.put_nowait((kind, payload, future))
+        return future
+
+    def _worker(self):
+        held = None
+        while True:
+            kind, payload, future = held or self.queue.get()
+            held = None
+
+            if kind == "call":
+                self._run_call(payload, future)
+                continue
+
+            # Collect more frames until the batch is full or max_wait has passed
+            batch = [(payload, future)]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry[0] == "call":
+                    # Run it right after this batch
+                    held = entry
+                    break
+                batch.append((entry[1], entry[2]))
+
+            self._run_batch(batch)
+
+    def _run_call(self, payload, future):
+        fn, args = payload
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _run_batch(self, batch):
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        with self.lock:
+            self.batches += 1
+            self.batched_items += len(batch)
+        try:
+            results = self.batch_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,131 @@
+import collections
+import math
+import threading
+import time
+import cv2
+from face_tracker import iou
+
+# --- Liveness Pre-filter ---
+# Cheap checks on a detected face that run before the anti-spoofing model:
+# a face that is too small, blurred, badly exposed or turned away can't be
+# recognized reliably anyway, so it is rejected in microseconds with a reason
+# the client can show ("Move closer", "Hold still", ...) instead of paying for
+# anti-spoofing, embedding and search. Faces that pass go on to anti-spoofing,
+# whose "real" verdict a client session can reuse for a few seconds while the
+# same face stays in place.
+
+REJECTION_MESSAGES = {
+    "too_small": "Face too small. Please move closer to the camera.",
+    "blurry": "Image too blurry. Please hold still.",
+    "too_dark": "Face too dark. Please find better lighting.",
+    "too_bright": "Face overexposed. Please avoid direct light on the face or camera.",
+    "pose": "Please look straight at the camera.",
+}
+
+# Faces are compared at this height so sharpness doesn't depend on face size
+SHARPNESS_HEIGHT = 112
+
+
+def face_sharpness(gray_face):
+    """
+    Variance of the Laplacian of a grayscale face crop: low for blurred faces.
+    """
+    scale = SHARPNESS_HEIGHT / gray_face.shape[0]
+    if scale < 1:
+        gray_face = cv2.resize(gray_face, (max(1, int(gray_face.shape[1] * scale)), SHARPNESS_HEIGHT),
+                               interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray_face, cv2.CV_64F).var())
+
+
+def face_pose(facial_area):
+    """
+    Returns (roll in degrees, horizontal offset of the eyes' midpoint from the
+    box center as a fraction of the face width), or None without eye landmarks.
+    """
+    left_eye, right_eye = facial_area.get('left_eye'), facial_area.get('right_eye')
+    if left_eye is None or right_eye is None:
+        return None
+    (x0, y0), (x1, y1) = sorted([left_eye, right_eye])
+    roll = abs(math.degrees(math.atan2(y1 - y0, x1 - x0)))
+    offset = abs((x0 + x1) / 2 - (facial_area['x'] + facial_area['w'] / 2)) / max(facial_area['w'], 1)
+    return roll, offset
+
+
+def assess_face(frame, facial_area, min_face_size=80, min_sharpness=30.0, min_brightness=40,
+                max_brightness=220, max_roll=25.0, max_yaw_offset=0.2):
+    """
+    Runs the pre-filter on one detected face. Returns None if the face is
+    usable, otherwise a reason from REJECTION_MESSAGES. Checks run cheapest
+    first and a threshold of 0 (or None) disables its check.
+    """
+    x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
+    if min_face_size and min(w, h) < min_face_size:
+        return "too_small"
+
+    if max_roll or max_yaw_offset:
+        pose = face_pose(facial_area)
+        if pose is not None:
+            roll, offset = pose
+            if (max_roll and roll > max_roll) or (max_yaw_offset and offset > max_yaw_offset):
+                return "pose"
+
+    face = frame[max(0, y):y + h, max(0, x):x + w]
+    if face.size == 0:
+        return "too_small"
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if face.ndim == 3 else face
+    brightness = float(gray.mean())
+    if min_brightness and brightness < min_brightness:
+        return "too_dark"
+    if max_brightness and brightness > max_brightness:
+        return "too_bright"
+    if min_sharpness and face_sharpness(gray) < min_sharpness:
+        return "blurry"
+    return None
+
+
+class RecentVerdicts:
+    """
+    Recent "real" anti-spoofing verdicts per client session. A face whose box
+    overlaps a box judged real in the same session less than `ttl` seconds ago
+    (IoU of at least `min_iou`) reuses that verdict. Reuse never extends the
+    verdict, so anti-spoofing still runs at least every `ttl` seconds.
+    """
+
+    def __init__(self, ttl=3.0, min_iou=0.5, max_sessions=1024, max_faces=8):
+        self.ttl = ttl
+        self.min_iou = min_iou
+        self.max_sessions = max_sessions
+        self.max_faces = max_faces
+        self.sessions = collections.OrderedDict()  # session -> deque of (box, expires)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def lookup(self, session, box):
+        """
+        Returns True if the session has a recent real verdict for this box.
+        """
+        now = time.monotonic()
+        with self.lock:
+            verdicts = self.sessions.get(session)
+            if not verdicts:
+                return False
+            self.sessions.move_to_end(session)
+            return any(expires > now and iou(box, real_box) >= self.min_iou for real_box, expires in verdicts)
+
+    def put(self, session, box):
+        now = time.monotonic()
+        with self.lock:
+            verdicts = self.sessions.get(session)
+            if verdicts is None:
+                verdicts = self.sessions[session] = collections.deque(maxlen=self.max_faces)
+            else:
+                self.sessions.move_to_end(session)
+                # Drop expired verdicts
+                live = [verdict for verdict in verdicts if verdict[1] > now]
+                verdicts.clear()
+                verdicts.extend(live)
+            verdicts.append((box, now + self.ttl))
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
@@ -0,0 +1,714 @@
+import threading
+import numpy as np
+from embedding_store import user_of
+
+# --- Gallery Matcher ---
+# Holds every gallery embedding as one L2-normalized float32 matrix so a probe
+# can be scored against the whole gallery with a single matrix-vector product.
+
+
+def l2_normalize(vectors):
+    """
+    L2-normalizes a vector or each row of a matrix, returning float32.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class GalleryMatcher:
+    """
+    Exact cosine-similarity search over the gallery embeddings.
+    """
+
+    def __init__(self):
+        self.identities = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.size = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.size
+
+    def rebuild(self, items):
+        """
+        Replaces the gallery with the given (identity, embedding) pairs.
+        """
+        with self.lock:
+            self.identities = [identity for identity, _ in items]
+            if items:
+                self.matrix = l2_normalize(np.stack([embedding for _, embedding in items]))
+            else:
+                self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.size = len(self.identities)
+
+    def attach(self, identities, matrix):
+        """
+        Searches an existing L2-normalized matrix in place (e.g. a read-only
+        memory map) whose first len(identities) rows are valid.
+        """
+        with self.lock:
+            self.identities = identities
+            self.matrix = matrix
+            self.size = len(identities)
+
+    def add(self, identity, embedding):
+        """
+        Appends one embedding. The matrix grows geometrically so repeated
+        registrations don't copy the whole gallery every time.
+        """
+        vector = l2_normalize(embedding)
+        with self.lock:
+            if self.size == 0 or self.matrix.shape[1] != vector.shape[0]:
+                if self.size:
+                    raise ValueError(f"Embedding has {vector.shape[0]} dimensions, gallery has {self.matrix.shape[1]}.")
+                self.matrix = np.zeros((16, vector.shape[0]), dtype=np.float32)
+            elif self.size == self.matrix.shape[0]:
+                grown = np.zeros((self.size * 2, self.matrix.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.matrix[:self.size]
+                self.matrix = grown
+            self.matrix[self.size] = vector
+            self.identities.append(identity)
+            self.size += 1
+
+    def remove_user(self, name):
+        """
+        Drops every row belonging to the given user.
+        """
+        with self.lock:
+            keep = [i for i, identity in enumerate(self.identities) if user_of(identity) != name]
+            if len(keep) == self.size:
+                return
+            self.matrix = self.matrix[keep]
+            self.identities = [self.identities[i] for i in keep]
+            self.size = len(keep)
+
+    def search(self, embedding, k=1):
+        """
+        Returns up to k (identity, similarity) pairs, best match first.
+        """
+        probe = l2_normalize(embedding)
+        with self.lock:
+            if self.size == 0:
+                return []
+            scores = self.matrix[:self.size] @ probe
+            identities = self.identities
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(identities[i], float(scores[i])) for i in top]
+
+    def search_many(self, embeddings, k=1):
+        """
+        Searches several probes with one matrix-matrix product. Returns one
+        search() result list per probe.
+        """
+        if len(embeddings) == 0:
+            return []
+        probes = l2_normalize(embeddings)
+        with self.lock:
+            if self.size == 0:
+                return [[] for _ in range(len(probes))]
+            scores = self.matrix[:self.size] @ probes.T
+            identities = self.identities
+
+        k = min(k, len(scores))
+        results = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+            results.append([(identities[i], float(column[i])) for i in top])
+        return results
+
+
+# --- Approximate Nearest-Neighbour Index ---
+# An inverted-file (IVF) index: gallery vectors are bucketed by their closest
+# k-means centroid and a probe only scans the `nprobe` closest buckets. Until
+# the gallery is large enough to train on, everything lives in a single bucket
+# and search is exact.
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, sample_size=65536, seed=0):
+    """
+    Trains unit-length k-means centroids on (a sample of) normalized vectors.
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        # Re-seed empty clusters with random vectors so no bucket stays unused
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = l2_normalize(sums)
+    return centroids
+
+
+class IVFMatcher:
+    """
+    Approximate cosine-similarity search with the same interface as GalleryMatcher.
+    """
+
+    def __init__(self, nlist=256, nprobe=16, min_train_size=None):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size or nlist * 39
+        self.centroids = None
+        self.lists = [self._empty_list()]
+        self.size = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _empty_list():
+        return {"identities": [], "vectors": None}
+
+    def __len__(self):
+        return self.size
+
+    def rebuild(self, items):
+        """
+        Replaces the gallery, training the coarse quantizer if there is enough data.
+        """
+        identities = [identity for identity, _ in items]
+        vectors = l2_normalize(np.stack([embedding for _, embedding in items])) if items else None
+
+        with self.lock:
+            self.size = len(identities)
+            if self.size >= self.min_train_size:
+                self.centroids = spherical_kmeans(vectors, self.nlist)
+                assignment = self._assign(vectors)
+                order = np.argsort(assignment, kind="stable")
+                bounds = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+                self.lists = []
+                for c in range(self.nlist):
+                    rows = order[bounds[c]:bounds[c + 1]]
+                    self.lists.append({
+                        "identities": [identities[i] for i in rows],
+                        "vectors": vectors[rows] if len(rows) else None,
+                    })
+            else:
+                self.centroids = None
+                self.lists = [{"identities": identities, "vectors": vectors}]
+
+    def _assign(self, vectors, chunk_size=8192):
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignment[start:start + chunk_size] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignment
+
+    def _items(self):
+        items = []
+        for bucket in self.lists:
+            if bucket["vectors"] is not None:
+                items.extend(zip(bucket["identities"], bucket["vectors"]))
+        return items
+
+    def add(self, identity, embedding):
+        """
+        Inserts one embedding into its closest bucket. The index is trained
+        the first time the gallery crosses min_train_size.
+        """
+        vector = l2_normalize(embedding)
+        with self.lock:
+            if self.centroids is None and self.size + 1 >= self.min_train_size:
+                self.rebuild(self._items() + [(identity, vector)])
+                return
+            c = 0 if self.centroids is None else int(np.argmax(self.centroids @ vector))
+            bucket = self.lists[c]
+            if bucket["vectors"] is None:
+                bucket["vectors"] = vector[np.newaxis, :]
+            else:
+                bucket["vectors"] = np.vstack([bucket["vectors"], vector])
+            bucket["identities"].append(identity)
+            self.size += 1
+
+    def remove_user(self, name):
+        """
+        Drops every row belonging to the given user from all buckets.
+        """
+        with self.lock:
+            for bucket in self.lists:
+                keep = [i for i, identity in enumerate(bucket["identities"]) if user_of(identity) != name]
+                if len(keep) == len(bucket["identities"]):
+                    continue
+                self.size -= len(bucket["identities"]) - len(keep)
+                bucket["identities"] = [bucket["identities"][i] for i in keep]
+                bucket["vectors"] = bucket["vectors"][keep] if keep else None
+
+    def search(self, embedding, k=1, nprobe=None):
+        """
+        Returns up to k (identity, similarity) pairs, best match first.
+        """
+        probe = l2_normalize(embedding)
+        with self.lock:
+            if self.size == 0:
+                return []
+            if self.centroids is None:
+                probed = self.lists
+            else:
+                nprobe = min(nprobe or self.nprobe, self.nlist)
+                closest = np.argpartition(-(self.centroids @ probe), nprobe - 1)[:nprobe]
+                probed = [self.lists[c] for c in closest]
+            probed = [bucket for bucket in probed if bucket["vectors"] is not None]
+            # Copy under the lock so a concurrent add can't shift the identity order
+            identities = [identity for bucket in probed for identity in bucket["identities"]]
+            matrices = [bucket["vectors"] for bucket in probed]
+
+        if not matrices:
+            return []
+        scores = np.concatenate([vectors @ probe for vectors in matrices])
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(identities[i], float(scores[i])) for i in top]
+
+    def search_many(self, embeddings, k=1):
+        """
+        Returns one search() result list per probe.
+        """
+        return [self.search(embedding, k) for embedding in embeddings]
+
+
+# --- Quantized Matcher ---
+# Large embeddings (VGG-Face has 4096 dimensions) make the float32 gallery
+# matrix expensive to hold. The quantized matcher keeps compressed codes in
+# memory, scores the whole gallery on them, and rescores only the best
+# candidates against the full-precision embeddings, which stay wherever the
+# caller keeps them (e.g. rows of the memory-mapped embedding store).
+#
+#   float16  2 bytes per dimension
+#   int8     1 byte per dimension plus one float32 scale per vector
+#   pq       product quantization: 1 byte per sub-vector (e.g. 64 bytes for
+#            any dimension with 64 sub-vectors). Codebooks are trained once the
+#            gallery reaches min_train_size; until then vectors are kept as float16.
+
+
+def kmeans(vectors, n_clusters, n_iter=10, seed=0):
+    """
+    Plain (Euclidean) k-means, used to train product-quantization codebooks.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        distances = (vectors ** 2).sum(1, keepdims=True) - 2 * vectors @ centroids.T + (centroids ** 2).sum(1)
+        assignment = np.argmin(distances, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+            counts[empty] = 1
+        centroids = sums / counts[:, np.newaxis]
+    return centroids
+
+
+class QuantizedMatcher:
+    """
+    Cosine-similarity search over float16, int8 or product-quantized vectors
+    with full-precision rescoring of the top `rescore` candidates.
+    Same interface as GalleryMatcher.
+    """
+
+    def __init__(self, precision="int8", rescore=32, pq_subvectors=64, min_train_size=4096, chunk_size=16384):
+        if precision not in ("float16", "int8", "pq"):
+            raise ValueError(f"Unknown precision '{precision}'. Use 'float16', 'int8' or 'pq'.")
+        self.precision = precision
+        self.rescore = rescore
+        self.pq_subvectors = pq_subvectors
+        self.min_train_size = max(min_train_size, 256)
+        self.chunk_size = chunk_size
+        self.identities = []
+        self.full = []          # full-precision embeddings as passed in, used for rescoring
+        self.codes = None
+        self.scales = None      # int8 only
+        self.codebooks = None   # pq only, once trained: (subvectors, 256, dim / subvectors)
+        self.size = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self):
+        """
+        Memory held by the compressed codes (not the full-precision embeddings).
+        """
+        arrays = [self.codes, self.scales, self.codebooks]
+        return sum(array[:self.size].nbytes if array is self.codes or array is self.scales else array.nbytes
+                   for array in arrays if array is not None)
+
+    # --- Encoding ---
+
+    def _train(self, vectors):
+        dim = vectors.shape[1]
+        subvectors = max(m for m in range(1, min(self.pq_subvectors, dim) + 1) if dim % m == 0)
+        sub_dim = dim // subvectors
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), min(len(vectors), 65536), replace=False)]
+        self.codebooks = np.stack([
+            kmeans(sample[:, j * sub_dim:(j + 1) * sub_dim], 256).astype(np.float32) for j in range(subvectors)
+        ])
+
+    def _encode(self, vectors):
+        """
+        Returns (codes, scales) for L2-normalized vectors.
+        """
+        if self.precision == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(vectors / scales[:, np.newaxis]).astype(np.int8), scales.astype(np.float32)
+        if self.precision == "pq" and self.codebooks is not None:
+            subvectors, _, sub_dim = self.codebooks.shape
+            codes = np.empty((len(vectors), subvectors), dtype=np.uint8)
+            for j in range(subvectors):
+                part = vectors[:, j * sub_dim:(j + 1) * sub_dim]
+                distances = -2 * part @ self.codebooks[j].T + (self.codebooks[j] ** 2).sum(1)
+                codes[:, j] = np.argmin(distances, axis=1)
+            return codes, None
+        return vectors.astype(np.float16), None
+
+    def _normalized(self, embeddings):
+        return l2_normalize(np.stack(embeddings))
+
+    def rebuild(self, items):
+        """
+        Replaces the gallery. Embeddings are encoded chunk by chunk, so a
+        memory-mapped store is never copied into RAM as a whole.
+        """
+        with self.lock:
+            self.identities = [identity for identity, _ in items]
+            self.full = [embedding for _, embedding in items]
+            self.size = len(items)
+            self.codes = self.scales = self.codebooks = None
+            if not items:
+                return
+            if self.precision == "pq" and self.size >= self.min_train_size:
+                sample_rows = np.random.default_rng(0).choice(self.size, min(self.size, 65536), replace=False)
+                self._train(self._normalized([self.full[i] for i in sample_rows]))
+
+            codes, scales = [], []
+            for start in range(0, self.size, self.chunk_size):
+                chunk_codes, chunk_scales = self._encode(self._normalized(self.full[start:start + self.chunk_size]))
+                codes.append(chunk_codes)
+                scales.append(chunk_scales)
+            self.codes = np.concatenate(codes)
+            self.scales = np.concatenate(scales) if self.precision == "int8" else None
+
+    def add(self, identity, embedding):
+        """
+        Appends one embedding, growing the code array geometrically.
+        """
+        with self.lock:
+            if self.precision == "pq" and self.codebooks is None and self.size + 1 >= self.min_train_size:
+                self.rebuild(list(zip(self.identities, self.full)) + [(identity, embedding)])
+                return
+            codes, scales = self._encode(l2_normalize(embedding)[np.newaxis, :])
+            if self.codes is None:
+                self.codes = np.zeros((16,) + codes.shape[1:], dtype=codes.dtype)
+                self.scales = np.zeros(16, dtype=np.float32) if scales is not None else None
+            elif self.size and self.codes.shape[1:] != codes.shape[1:]:
+                raise ValueError(f"Embedding has {len(embedding)} dimensions, gallery has {len(self.full[0])}.")
+            elif self.size == len(self.codes) or self.codes.shape[1:] != codes.shape[1:]:
+                # At least 16 rows, so a gallery emptied by remove_user grows again
+                capacity = max(16, 2 * self.size)
+                grown = np.zeros((capacity,) + codes.shape[1:], dtype=codes.dtype)
+                grown[:self.size] = self.codes[:self.size]
+                self.codes = grown
+                if scales is not None:
+                    grown_scales = np.zeros(capacity, dtype=np.float32)
+                    grown_scales[:self.size] = self.scales[:self.size]
+                    self.scales = grown_scales
+            self.codes[self.size] = codes[0]
+            if scales is not None:
+                self.scales[self.size] = scales[0]
+            self.identities.append(identity)
+            self.full.append(np.asarray(embedding, dtype=np.float32))
+            self.size += 1
+
+    def remove_user(self, name):
+        """
+        Drops every row belonging to the given user.
+        """
+        with self.lock:
+            keep = [i for i, identity in enumerate(self.identities) if user_of(identity) != name]
+            if len(keep) == self.size:
+                return
+            self.codes = self.codes[keep]
+            if self.scales is not None:
+                self.scales = self.scales[keep]
+            self.identities = [self.identities[i] for i in keep]
+            self.full = [self.full[i] for i in keep]
+            self.size = len(keep)
+
+    # --- Search ---
+
+    def _approximate_scores(self, probe):
+        scores = np.empty(self.size, dtype=np.float32)
+        if self.codebooks is not None:
+            subvectors, _, sub_dim = self.codebooks.shape
+            # Asymmetric distance: one lookup table per sub-vector, summed per code
+            table = np.einsum("jcd,jd->jc", self.codebooks, probe.reshape(subvectors, sub_dim))
+            columns = np.arange(subvectors)
+        # Decoded blocks of ~1 MB stay in cache; decoding big blocks is memory-bound
+        rows = self.chunk_size if self.codebooks is not None else max(64, (1 << 18) // len(probe))
+        for start in range(0, self.size, rows):
+            block = self.codes[start:min(start + rows, self.size)]
+            if self.codebooks is not None:
+                scores[start:start + len(block)] = table[columns, block].sum(axis=1)
+            elif self.scales is not None:
+                scores[start:start + len(block)] = (block.astype(np.float32) @ probe) * self.scales[start:start + len(block)]
+            else:
+                scores[start:start + len(block)] = block.astype(np.float32) @ probe
+        return scores
+
+    def search(self, embedding, k=1, rescore=None):
+        """
+        Returns up to k (identity, similarity) pairs, best match first. The
+        top max(k, rescore) approximate matches are rescored at full precision.
+        """
+        probe = l2_normalize(embedding)
+        rescore = self.rescore if rescore is None else rescore
+        with self.lock:
+            if self.size == 0:
+                return []
+            scores = self._approximate_scores(probe)
+            n_candidates = min(max(k, rescore), self.size)
+            candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            identities = [self.identities[i] for i in candidates]
+            if rescore:
+                scores = self._normalized([self.full[i] for i in candidates]) @ probe
+            else:
+                scores = scores[candidates]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(identities[i], float(scores[i])) for i in top]
+
+    def search_many(self, embeddings, k=1):
+        """
+        Returns one search() result list per probe.
+        """
+        return [self.search(embedding, k) for embedding in embeddings]
+
+
+# --- Identity Templates ---
+# Each user's embeddings are aggregated into up to `templates_per_user`
+# templates: their normalized mean, or spherical k-means centers when a user
+# has several clusters of photos (glasses, lighting, age). A probe is scored
+# against the templates first, and only the images of the `shortlist` best
+# users are rescored, so a user with 20 photos costs about as much as one with
+# a single photo. Templates of a user are recomputed from that user's images
+# whenever they change.
+
+
+class TemplateMatcher:
+    """
+    Two-stage cosine-similarity search (identity templates, then the shortlisted
+    users' images) with the same interface as GalleryMatcher. Results and
+    similarities are per image, as with exact search.
+    """
+
+    def __init__(self, templates_per_user=1, shortlist=5):
+        self.templates_per_user = templates_per_user
+        self.shortlist = shortlist
+        self.users = {}  # name -> {"identities", "vectors", "templates"}
+        self.size = 0
+        self.templates = None  # stacked templates of every user, rebuilt lazily after changes
+        self.owners = []       # user name per row of self.templates
+        self.starts = None     # first template row of each user in self.owners order
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.size
+
+    def template_counts(self):
+        """
+        Returns {user name: number of templates}.
+        """
+        with self.lock:
+            return {name: len(user["templates"]) for name, user in self.users.items()}
+
+    def _templates(self, vectors):
+        n_templates = min(self.templates_per_user, len(vectors))
+        if n_templates == 1:
+            return l2_normalize(vectors.mean(axis=0, keepdims=True))
+        return spherical_kmeans(vectors, n_templates)
+
+    def _set_user(self, name, identities, vectors):
+        self.users[name] = {"identities": identities, "vectors": vectors, "templates": self._templates(vectors)}
+        self.templates = None
+
+    def rebuild(self, items):
+        """
+        Replaces the gallery with the given (identity, embedding) pairs.
+        """
+        grouped = {}
+        for identity, embedding in items:
+            grouped.setdefault(user_of(identity), []).append((identity, embedding))
+        with self.lock:
+            self.users = {}
+            for name, user_items in grouped.items():
+                self._set_user(name, [identity for identity, _ in user_items],
+                               l2_normalize(np.stack([embedding for _, embedding in user_items])))
+            self.size = len(items)
+            self.templates = None
+
+    def add(self, identity, embedding):
+        """
+        Adds one embedding and recomputes its user's templates.
+        """
+        vector = l2_normalize(embedding)
+        name = user_of(identity)
+        with self.lock:
+            user = self.users.get(name)
+            if user is None:
+                self._set_user(name, [identity], vector[None, :])
+            else:
+                self._set_user(name, user["identities"] + [identity], np.vstack([user["vectors"], vector]))
+            self.size += 1
+
+    def remove_user(self, name):
+        """
+        Drops the user's images and templates.
+        """
+        with self.lock:
+            user = self.users.pop(name, None)
+            if user is not None:
+                self.size -= len(user["identities"])
+                self.templates = None
+
+    def _stacked(self):
+        # Called under the lock
+        if self.templates is None:
+            names = list(self.users)
+            blocks = [self.users[name]["templates"] for name in names]
+            self.templates = np.vstack(blocks)
+            self.owners = names
+            self.starts = np.cumsum([0] + [len(block) for block in blocks[:-1]])
+        return self.templates, self.owners, self.starts
+
+    def _rescore(self, names, probe, k):
+        # Called under the lock
+        identities = [identity for name in names for identity in self.users[name]["identities"]]
+        scores = np.concatenate([self.users[name]["vectors"] @ probe for name in names])
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(identities[i], float(scores[i])) for i in top]
+
+    def search_many(self, embeddings, k=1, shortlist=None):
+        """
+        Scores every probe against all templates with one matrix-matrix
+        product, then rescores the images of each probe's best users. Returns
+        one search() result list per probe.
+        """
+        if len(embeddings) == 0:
+            return []
+        probes = l2_normalize(embeddings)
+        shortlist = shortlist or self.shortlist
+        with self.lock:
+            if self.size == 0:
+                return [[] for _ in range(len(probes))]
+            templates, owners, starts = self._stacked()
+            # Best template score per user
+            user_scores = np.maximum.reduceat(templates @ probes.T, starts, axis=0)
+            n_users = min(shortlist, len(owners))
+            results = []
+            for column, probe in zip(user_scores.T, probes):
+                best = np.argpartition(-column, n_users - 1)[:n_users]
+                results.append(self._rescore([owners[i] for i in best], probe, k))
+            return results
+
+    def search(self, embedding, k=1, shortlist=None):
+        """
+        Returns up to k (identity, similarity) pairs, best match first.
+        """
+        return self.search_many([embedding], k, shortlist)[0]
+
+
+# --- Batch Search ---
+# Offline many-to-many search (find_person.py): probes are scored against the
+# gallery with matrix-matrix products, one block of rows at a time, so memory
+# stays bounded by the block size no matter how large both sides are.
+
+
+def _stacked_block(vectors, start, stop):
+    return l2_normalize(np.stack(vectors[start:stop])) if stop > start else np.zeros((0, 0), dtype=np.float32)
+
+
+def chunked_top_k(queries, gallery, k=1, query_chunk=1024, gallery_chunk=16384):
+    """
+    Exact top-k gallery rows for every query. queries and gallery are
+    sequences of vectors (e.g. store rows, which may be memory-mapped).
+    Returns (indices, scores) arrays of shape (len(queries), min(k, len(gallery))),
+    best match first.
+    """
+    k = min(k, len(gallery))
+    indices = np.zeros((len(queries), k), dtype=np.int64)
+    scores = np.zeros((len(queries), k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+
+    for q_start in range(0, len(queries), query_chunk):
+        q_stop = min(q_start + query_chunk, len(queries))
+        probes = _stacked_block(queries, q_start, q_stop)
+        best_scores = np.full((len(probes), 0), -np.inf, dtype=np.float32)
+        best_indices = np.zeros((len(probes), 0), dtype=np.int64)
+        for g_start in range(0, len(gallery), gallery_chunk):
+            block_scores = probes @ _stacked_block(gallery, g_start, min(g_start + gallery_chunk, len(gallery))).T
+            block_k = min(k, block_scores.shape[1])
+            top = np.argpartition(-block_scores, block_k - 1, axis=1)[:, :block_k]
+            # Merge this block's candidates with the best so far
+            candidate_scores = np.concatenate([best_scores, np.take_along_axis(block_scores, top, axis=1)], axis=1)
+            candidate_indices = np.concatenate([best_indices, top + g_start], axis=1)
+            keep = np.argsort(-candidate_scores, axis=1, kind="stable")[:, :k]
+            best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+            best_indices = np.take_along_axis(candidate_indices, keep, axis=1)
+        indices[q_start:q_stop] = best_indices
+        scores[q_start:q_stop] = best_scores
+    return indices, scores
+
+
+def similar_pairs(vectors, threshold, chunk_size=4096):
+    """
+    Yields (i, j, similarity) for every pair i < j of vectors whose cosine
+    similarity is at least threshold, comparing one block pair at a time.
+    """
+    for i_start in range(0, len(vectors), chunk_size):
+        i_stop = min(i_start + chunk_size, len(vectors))
+        rows = _stacked_block(vectors, i_start, i_stop)
+        # Blocks left of the diagonal were covered when they were the row block
+        for j_start in range(i_start, len(vectors), chunk_size):
+            j_stop = min(j_start + chunk_size, len(vectors))
+            columns = rows if j_start == i_start else _stacked_block(vectors, j_start, j_stop)
+            block_scores = rows @ columns.T
+            if j_start == i_start:
+                block_scores[np.tril_indices(len(rows))] = -np.inf
+            for i, j in zip(*np.nonzero(block_scores >= threshold)):
+                yield i_start + int(i), j_start + int(j), float(block_scores[i, j])
+
+
+def create_matcher(mode="exact", **params):
+    """
+    Builds the matcher selected by configuration: 'exact', 'ivf', 'quantized'
+    or 'template'.
+    """
+    if mode == "exact":
+        return GalleryMatcher()
+    if mode == "ivf":
+        return IVFMatcher(**params)
+    if mode == "quantized":
+        return QuantizedMatcher(**params)
+    if mode == "template":
+        return TemplateMatcher(**params)
+    raise ValueError(f"Unknown index mode '{mode}'. Use 'exact', 'ivf', 'quantized' or 'template'.")
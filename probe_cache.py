@@ -0,0 +1,149 @@
+import collections
+import threading
+import time
+import numpy as np
+import cv2
+
+# --- Probe Cache ---
+# Kiosk clients send several near-identical frames of the same person per
+# second. Results are cached for a few seconds keyed by a perceptual hash of
+# the face crop plus its brightness, so a repeated face skips anti-spoofing,
+# embedding and search, and by the probe embedding, so a face whose crop
+# changed a little but embeds almost identically skips the gallery search. Entries expire after `ttl`
+# seconds and the least recently used entry is evicted when the cache is full.
+
+
+def face_key(image, hash_size=16):
+    """
+    Returns (difference hash, mean brightness) of a face crop. The hash is
+    robust to small shifts and noise, so consecutive frames of a still face
+    hash alike; it ignores overall brightness, which is kept separately.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), float(small.mean())
+
+
+class ProbeCache:
+    """
+    TTL + LRU cache of verification results for recent probe faces.
+
+    Lookups by face key accept a hash Hamming distance up to
+    `max_hash_distance` (of 256 bits) and a brightness difference up to
+    `max_brightness_delta`; lookups by embedding need a cosine similarity of
+    at least `min_similarity`.
+    `on_evict(reason, count)` is called for every eviction ('expired', 'lru',
+    'invalidated').
+    """
+
+    def __init__(self, ttl=2.0, max_entries=256, max_hash_distance=16, max_brightness_delta=10,
+                 min_similarity=0.97, on_evict=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_hash_distance = max_hash_distance
+        self.max_brightness_delta = max_brightness_delta
+        self.min_similarity = min_similarity
+        self.on_evict = on_evict
+        self.entries = collections.OrderedDict()  # key -> {"face_key", "embedding", "result", "expires"}
+        self.lock = threading.Lock()
+        self.keys = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _evicted(self, reason, count):
+        if count and self.on_evict is not None:
+            self.on_evict(reason, count)
+
+    def _expire(self, now):
+        expired = [key for key, entry in self.entries.items() if entry["expires"] <= now]
+        for key in expired:
+            del self.entries[key]
+        self._evicted("expired", len(expired))
+
+    def _hit(self, key):
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return dict(self.entries[key]["result"])
+
+    def lookup_face(self, face_key):
+        """
+        Returns the cached result for a face crop's (hash, brightness), or None.
+        """
+        face_hash, brightness = face_key
+        with self.lock:
+            self._expire(time.monotonic())
+            for key, entry in reversed(self.entries.items()):
+                cached_hash, cached_brightness = entry["face_key"]
+                if (abs(cached_brightness - brightness) <= self.max_brightness_delta
+                        and bin(cached_hash ^ face_hash).count("1") <= self.max_hash_distance):
+                    return self._hit(key)
+            return None
+
+    def lookup_embedding(self, embedding):
+        """
+        Returns the cached result for a probe embedding, or None. Counts the
+        miss, since the embedding is only looked up after the face key missed.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self.lock:
+            self._expire(time.monotonic())
+            for key, entry in reversed(self.entries.items()):
+                if entry["embedding"] is not None and float(entry["embedding"] @ vector) >= self.min_similarity:
+                    return self._hit(key)
+            self.misses += 1
+            return None
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def put(self, face_key, embedding, result):
+        """
+        Caches a result. embedding may be None (e.g. for spoof verdicts).
+        """
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        with self.lock:
+            self.keys += 1
+            self.entries[self.keys] = {
+                "face_key": face_key,
+                "embedding": embedding,
+                "result": dict(result),
+                "expires": time.monotonic() + self.ttl,
+            }
+            evicted = 0
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                evicted += 1
+            self._evicted("lru", evicted)
+
+    def invalidate(self, user=None):
+        """
+        With a user, drops results that identified that user (they were
+        deleted). Without one, drops every result a new registration could
+        change, i.e. all but spoof verdicts.
+        """
+        with self.lock:
+            if user is None:
+                stale = [key for key, entry in self.entries.items() if entry["result"].get("status") != "Failed"]
+            else:
+                stale = [key for key, entry in self.entries.items() if entry["result"].get("id") == user]
+            for key in stale:
+                del self.entries[key]
+            self._evicted("invalidated", len(stale))
+
+    def clear(self):
+        with self.lock:
+            count = len(self.entries)
+            self.entries.clear()
+            self._evicted("invalidated", count)
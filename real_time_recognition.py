@@ -1,48 +1,72 @@
+import os
+import sys
 import cv2
 from deepface import DeepFace
+from config import MODEL_NAME, DETECTOR_BACKEND, DETECTION_CONFIDENCE
+from face_tracker import FaceTracker
+from video_pipeline import run_pipeline
 
 # Path to your database of known faces
 db_path = "./database"
 
-cap = cv2.VideoCapture(0)
+# Detect faces every N frames and track them in between; each face is only
+# recognized when it first appears (or its detection confidence drops).
+# Set to 1 to detect every frame.
+DETECT_EVERY_N_FRAMES = 5
+# Frames between retries for faces that were not recognized
+RECHECK_UNKNOWN_FRAMES = 30
 
-if not cap.isOpened():
-    print("Cannot open camera")
-    exit()
+# Camera index or video file: python real_time_recognition.py clip.mp4
+VIDEO_SOURCE = sys.argv[1] if len(sys.argv) > 1 else 0
+# Drop stale frames so inference always works on the newest one (False: process every frame)
+DROP_FRAMES = True
 
-while True:
-    ret, frame = cap.read()
+tracker = FaceTracker(min_confidence=DETECTION_CONFIDENCE, recheck_interval=RECHECK_UNKNOWN_FRAMES)
+frame_index = 0
 
-    if not ret:
-        print("Can't receive frame (stream end?). Exiting ...")
-        break
 
+def process_frame(frame):
+    # Runs on the inference thread, so capture and display never wait for the models
+    global frame_index
     try:
-        # The find function will search for faces in the frame within the database
-        dfs = DeepFace.find(img_path=frame, db_path=db_path, enforce_detection=False, silent=True)
-
-        if dfs and not dfs[0].empty:
-            for _, row in dfs[0].iterrows():
-                if 'identity' in row and 'source_x' in row:
-                    identity = row['identity']
-                    x, y, w, h = row['source_x'], row['source_y'], row['source_w'], row['source_h']
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if frame_index % DETECT_EVERY_N_FRAMES == 0:
+            face_objs = DeepFace.extract_faces(img_path=frame, detector_backend=DETECTOR_BACKEND, enforce_detection=False)
+            detections = [((f['facial_area']['x'], f['facial_area']['y'], f['facial_area']['w'], f['facial_area']['h']), f['confidence'])
+                          for f in face_objs if f['confidence'] > 0]
+            tracker.update(detections, gray)
+        else:
+            tracker.track(gray)
 
-                    # Draw a rectangle around the face
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        # The find function searches the database for each face that needs a (new) identity.
+        # It uses the same detector for the probe and the database images, so both are embedded the same way.
+        for track in tracker.needs_recognition(frame_index):
+            x, y, w, h = track.box
+            dfs = DeepFace.find(img_path=frame[max(0, y):y + h, max(0, x):x + w], db_path=db_path, model_name=MODEL_NAME,
+                                detector_backend=DETECTOR_BACKEND, enforce_detection=False, silent=True)
 
-                    # Put the name of the person
-                    # Extracting the name from the file path
-                    name = identity.split('/')[-1].split('.')[0]
-                    cv2.putText(frame, name, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+            if dfs and not dfs[0].empty:
+                # Extracting the name from the file path
+                name = os.path.basename(os.path.dirname(dfs[0]['identity'][0]))
+                tracker.set_identity(track, name, (0, 255, 0), True, frame_index)
+            else:
+                tracker.set_identity(track, "Unknown", (0, 0, 255), False, frame_index)
 
     except Exception as e:
         # Using a silent try-except block to handle frames with no faces gracefully
         pass
+    frame_index += 1
+
+    return [(track.box, track.label, track.color) for track in tracker.tracks if track.label is not None]
 
-    cv2.imshow('Real-time Face Recognition', frame)
 
-    if cv2.waitKey(1) == ord('q'):
-        break
+def draw_results(frame, results):
+    for (x, y, w, h), label, color in results:
+        # Draw a rectangle around the face and put the name of the person
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+        cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
 
-cap.release()
-cv2.destroyAllWindows()
+
+if not run_pipeline(VIDEO_SOURCE, process_frame, draw_results, 'Real-time Face Recognition', drop_frames=DROP_FRAMES):
+    print(f"Cannot open video source '{VIDEO_SOURCE}'")
+    exit()
@@ -0,0 +1,238 @@
+import os
+import glob
+import json
+import time
+import threading
+import numpy as np
+from embedding_store import model_slug, user_of
+from matcher import l2_normalize
+
+# --- Shared Gallery ---
+# When several worker processes serve the app, each one would otherwise keep
+# its own copy of the gallery matrix. Instead the normalized matrix is
+# published to a .npy file that every worker memory-maps read-only, so all of
+# them share the same pages. A small JSON manifest records the current file
+# generation and row count; workers stat it and remap when it changes.
+#
+# Files (next to the images in the database directory):
+#   gallery_<model>.json          manifest: generation, size, capacity, dim
+#   gallery_<model>.<gen>.npy     capacity x dim float32 matrix (first `size` rows valid)
+#   gallery_<model>.<gen>.ids     one identity per line, in row order
+#   gallery_<model>.lock          held by the process that is writing
+
+
+class FileLock:
+    """
+    Cross-process lock based on exclusively creating a lock file.
+    Re-entrant within a process. While the lock is held, a background thread
+    touches the lock file every `stale_after / 4` seconds, so waiters block
+    for as long as the holder is alive (or until `timeout` seconds, if given).
+    A lock file untouched for `stale_after` seconds belongs to a crashed
+    process and is broken.
+    """
+
+    def __init__(self, path, timeout=None, stale_after=60):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.local = threading.RLock()
+        self.depth = 0
+        self.released = threading.Event()
+        self.heartbeat = None
+
+    def __enter__(self):
+        self.local.acquire()
+        if self.depth == 0:
+            deadline = None if self.timeout is None else time.monotonic() + self.timeout
+            while True:
+                try:
+                    os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(self.path) > self.stale_after:
+                            os.remove(self.path)
+                            continue
+                    except OSError:
+                        continue
+                    if deadline is not None and time.monotonic() > deadline:
+                        self.local.release()
+                        raise TimeoutError(f"Could not acquire '{self.path}'.")
+                    time.sleep(0.01)
+            self.released.clear()
+            self.heartbeat = threading.Thread(target=self._beat, daemon=True)
+            self.heartbeat.start()
+        self.depth += 1
+        return self
+
+    def _beat(self):
+        while not self.released.wait(self.stale_after / 4):
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            self.released.set()
+            self.heartbeat.join()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        self.local.release()
+
+
+class SharedGallery:
+    """
+    Memory-mapped gallery matrix shared by every worker process.
+    """
+
+    def __init__(self, db_path, model_name):
+        self.base = os.path.join(db_path, f"gallery_{model_slug(model_name)}")
+        self.manifest_path = self.base + ".json"
+        self.lock = FileLock(self.base + ".lock")
+        self.key = None
+        self.manifest = None
+        self.matrix = None
+        self.identities = []
+
+    def _paths(self, generation):
+        return f"{self.base}.{generation}.npy", f"{self.base}.{generation}.ids"
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    # --- Writers (hold the lock) ---
+
+    def publish(self, items):
+        """
+        Writes a new generation holding the given (identity, embedding) pairs,
+        with spare capacity so later additions can be written in place.
+        """
+        with self.lock:
+            previous = self._read_manifest()
+            generation = previous["generation"] + 1 if previous else 1
+            identities = [identity for identity, _ in items]
+            vectors = l2_normalize(np.stack([embedding for _, embedding in items])) if items else None
+            dim = vectors.shape[1] if items else (previous["dim"] if previous else 0)
+            capacity = max(16, 2 * len(items))
+
+            matrix_path, ids_path = self._paths(generation)
+            matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32, shape=(capacity, max(dim, 1)))
+            if items:
+                matrix[:len(items)] = vectors
+            matrix.flush()
+            del matrix
+            ids_data = "".join(identity + "\n" for identity in identities).encode()
+            with open(ids_path, "wb") as f:
+                f.write(ids_data)
+
+            self._write_manifest({
+                "generation": generation,
+                "size": len(items),
+                "capacity": capacity,
+                "dim": dim,
+                "ids_bytes": len(ids_data),
+            })
+            self._remove_old_generations(generation)
+
+    def append(self, identity, embedding):
+        """
+        Adds one row in place, or publishes a larger generation when full.
+        """
+        vector = l2_normalize(embedding)
+        with self.lock:
+            manifest = self._read_manifest()
+            if manifest is None or manifest["size"] >= manifest["capacity"] or manifest["dim"] != vector.shape[0]:
+                if manifest is not None and manifest["size"] and manifest["dim"] != vector.shape[0]:
+                    raise ValueError(f"Embedding has {vector.shape[0]} dimensions, gallery has {manifest['dim']}.")
+                self.refresh()
+                self.publish(self._items() + [(identity, vector)])
+                return
+
+            matrix_path, ids_path = self._paths(manifest["generation"])
+            matrix = np.load(matrix_path, mmap_mode="r+")
+            matrix[manifest["size"]] = vector
+            matrix.flush()
+            del matrix
+
+            line = (identity + "\n").encode()
+            with open(ids_path, "r+b") as f:
+                # Drop anything a crashed writer left past the manifest's end
+                f.seek(manifest["ids_bytes"])
+                f.write(line)
+                f.truncate()
+
+            manifest["size"] += 1
+            manifest["ids_bytes"] += len(line)
+            self._write_manifest(manifest)
+
+    def remove_user(self, name):
+        """
+        Publishes a new generation without the given user's rows.
+        """
+        with self.lock:
+            self.refresh()
+            self.publish([(identity, vector) for identity, vector in self._items() if user_of(identity) != name])
+
+    def _items(self):
+        if self.matrix is None:
+            return []
+        return list(zip(self.identities, self.matrix[:len(self.identities)]))
+
+    def _remove_old_generations(self, generation):
+        current = set(self._paths(generation))
+        for path in glob.glob(self.base + ".*.npy") + glob.glob(self.base + ".*.ids"):
+            if path not in current:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still mapped by a worker on platforms that forbid this; retried next time
+                    pass
+
+    # --- Readers ---
+
+    def refresh(self):
+        """
+        Remaps the gallery if another process changed it. Cheap when nothing
+        changed (one stat call). Returns True if the gallery was reloaded.
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except OSError:
+            return False
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self.key:
+            return False
+
+        manifest = self._read_manifest()
+        if manifest is None:
+            return False
+        matrix_path, ids_path = self._paths(manifest["generation"])
+        try:
+            if self.manifest is None or manifest["generation"] != self.manifest["generation"]:
+                self.matrix = np.load(matrix_path, mmap_mode="r")
+            with open(ids_path, "rb") as f:
+                ids_data = f.read(manifest["ids_bytes"])
+        except OSError:
+            # A writer replaced this generation while we were reading; pick it up next time
+            return False
+        self.identities = ids_data.decode().splitlines()[:manifest["size"]]
+        self.manifest = manifest
+        self.key = key
+        return True
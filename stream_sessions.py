@@ -0,0 +1,170 @@
+import collections
+import threading
+import time
+import uuid
+import cv2
+from face_tracker import FaceTracker
+
+# --- Streaming Sessions ---
+# State for clients that stream frames continuously instead of calling
+# /verify once per frame. Each session tracks its faces between detections
+# (face_tracker.py), recognizes a face only when it first appears or its
+# result is in doubt, and publishes a new event only when the set of faces or
+# one of their results changes, so listeners are not flooded with identical
+# results at the frame rate.
+
+
+class StreamSession:
+    """
+    One client's stream: tracker, cached per-track results and the latest event.
+
+    detect_fn(frame) returns [(box, confidence)] and recognize_fn(frame, boxes)
+    returns one result dict per box with at least 'status' ('Verified',
+    'Unverified', 'Failed' for spoofs or 'Rejected' for unusable faces).
+    """
+
+    def __init__(self, session_id, detect_fn, recognize_fn, detect_every=5,
+                 spoof_history=3, min_confidence=0.9, recheck_interval=30):
+        self.id = session_id
+        self.detect_fn = detect_fn
+        self.recognize_fn = recognize_fn
+        self.detect_every = detect_every
+        self.spoof_history = spoof_history
+        self.tracker = FaceTracker(min_confidence=min_confidence, recheck_interval=recheck_interval)
+        self.results = {}   # track id -> last result dict
+        self.spoofs = {}    # track id -> recent anti-spoofing verdicts (True = spoof)
+        self.frame_index = 0
+        self.processing = threading.Lock()
+        self.condition = threading.Condition()
+        self.version = 0
+        self.event = None
+        self.event_key = None
+        self.closed = False
+        self.last_seen = time.monotonic()
+
+    def process(self, frame):
+        """
+        Runs one frame through the session. Returns False without doing any
+        work if the previous frame is still being processed (the frame is
+        dropped so the session never falls behind the stream).
+        """
+        if not self.processing.acquire(blocking=False):
+            return False
+        try:
+            self.last_seen = time.monotonic()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.frame_index % self.detect_every == 0:
+                self.tracker.update(self.detect_fn(frame), gray)
+            else:
+                self.tracker.track(gray)
+
+            due = self.tracker.needs_recognition(self.frame_index)
+            if due:
+                for track, result in zip(due, self.recognize_fn(frame, [track.box for track in due])):
+                    self._set_result(track, result)
+
+            live = {track.id for track in self.tracker.tracks}
+            for track_id in [i for i in self.results if i not in live]:
+                del self.results[track_id]
+                self.spoofs.pop(track_id, None)
+            self._publish()
+            self.frame_index += 1
+            return True
+        finally:
+            self.processing.release()
+
+    def _set_result(self, track, result):
+        if result['status'] == 'Rejected':
+            # Unusable frame (too small, blurred, ...): keep any earlier result, else
+            # show the reason, and try again on the next frame
+            previous = self.results.get(track.id)
+            if previous is None or previous['status'] == 'Rejected':
+                self.results[track.id] = result
+            return
+        # A single spoof verdict can be noise; report a spoof by majority over recent checks
+        history = self.spoofs.setdefault(track.id, collections.deque(maxlen=self.spoof_history))
+        history.append(result['status'] == 'Failed')
+        if result['status'] != 'Failed' and sum(history) * 2 > len(history):
+            result = {"status": "Failed", "message": "Spoof attempt detected."}
+        elif result['status'] == 'Failed' and sum(history) * 2 <= len(history):
+            result = dict(self.results.get(track.id) or {"status": "Unverified", "message": "Checking..."})
+        self.results[track.id] = result
+        self.tracker.set_identity(track, result.get('id') or result['status'], None,
+                                  result['status'] == 'Verified', self.frame_index)
+
+    def _publish(self):
+        faces = []
+        for track in self.tracker.tracks:
+            if track.id not in self.results:
+                continue
+            x, y, w, h = track.box
+            faces.append({"track": track.id, "box": {"x": x, "y": y, "w": w, "h": h}, **self.results[track.id]})
+        # Box movement alone is not a change; faces appearing, leaving or changing result are
+        key = tuple((face['track'], face['status'], face.get('id'), face.get('reason')) for face in faces)
+        if key == self.event_key:
+            return
+        with self.condition:
+            self.event_key = key
+            self.version += 1
+            self.event = {"session": self.id, "frame": self.frame_index, "faces": faces}
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        """
+        Blocks until an event newer than `version` is published, the session
+        is closed, or the timeout passes. Returns (version, event or None).
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version or self.closed, timeout)
+            if self.version == version:
+                return version, None
+            return self.version, self.event
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class SessionRegistry:
+    """
+    Live sessions of one process. Sessions that receive no frames for
+    `ttl` seconds are closed.
+    """
+
+    def __init__(self, max_sessions=32, ttl=60):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, **session_args):
+        """
+        Returns a new session, or None if max_sessions are already open.
+        """
+        self.expire()
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                return None
+            session = StreamSession(uuid.uuid4().hex, **session_args)
+            self.sessions[session.id] = session
+            return session
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def remove(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def expire(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if session.closed or now - session.last_seen > self.ttl:
+                self.remove(session_id)
@@ -1,12 +1,30 @@
 import cv2
 import os
+import sys
 import glob
 from deepface import DeepFace
+from deepface.modules import modeling
+from config import MODEL_NAME, DETECTOR_BACKEND, DETECTION_CONFIDENCE
+from face_tracker import FaceTracker
+from video_pipeline import run_pipeline
 
 # --- Configuration ---
 # The path to your face database.
 db_path = "./database"
 
+# Run the face detector only every N frames and track boxes in between.
+# Recognition and anti-spoofing run once per new track (and again when its
+# detection confidence drops), not once per frame. Set to 1 to detect every frame.
+DETECT_EVERY_N_FRAMES = 5
+# Frames between retries for faces that were not recognized.
+RECHECK_UNKNOWN_FRAMES = 30
+
+# Camera index or video file, e.g. `python test.py clip.mp4` to test without a webcam.
+VIDEO_SOURCE = sys.argv[1] if len(sys.argv) > 1 else 0
+# True: inference always takes the newest frame and stale ones are dropped (live video).
+# False: every frame is processed in order (e.g. to run a whole video file).
+DROP_FRAMES = True
+
 # --- Path and Verification ---
 # Convert to an absolute path to avoid any issues.
 db_path = os.path.abspath(db_path)
@@ -55,43 +73,48 @@ except Exception as e:
 # --- END OF NEW SECTION ---
 
 
-# --- Webcam Initialization ---
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("---!!! FATAL ERROR !!!---")
-    print("Cannot open webcam. Check if it's connected or used by another program.")
-    exit()
-
-print("-> Stream starting. Press 'q' in the window to quit.")
-
-# --- Main Loop ---
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break # Exit loop if the stream ends
+# --- Per-frame Inference ---
+# Runs on the pipeline's inference thread; capture and display run separately.
+tracker = FaceTracker(min_confidence=DETECTION_CONFIDENCE, recheck_interval=RECHECK_UNKNOWN_FRAMES)
+frame_index = 0
 
+def process_frame(frame):
+    global frame_index
     try:
-        # Detect faces and run the anti-spoofing check
-        face_objs = DeepFace.extract_faces(
-            img_path=frame,
-            detector_backend="mtcnn",
-            anti_spoofing=True,
-            enforce_detection=False
-        )
-
-        for face_obj in face_objs:
-            facial_area = face_obj['facial_area']
-            x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
-
-            if face_obj['is_real']:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if frame_index % DETECT_EVERY_N_FRAMES == 0:
+            # Detect faces and match them to the existing tracks
+            face_objs = DeepFace.extract_faces(
+                img_path=frame,
+                detector_backend=DETECTOR_BACKEND,
+                enforce_detection=False
+            )
+            detections = []
+            for face_obj in face_objs:
+                facial_area = face_obj['facial_area']
+                if face_obj['confidence'] > 0:
+                    box = (facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h'])
+                    detections.append((box, face_obj['confidence']))
+            tracker.update(detections, gray)
+        else:
+            # Move the existing boxes with optical flow
+            tracker.track(gray)
+
+        # Only new or uncertain faces go through anti-spoofing and recognition
+        for track in tracker.needs_recognition(frame_index):
+            x, y, w, h = track.box
+            is_real, _ = modeling.build_model(task="spoofing", model_name="Fasnet").analyze(
+                img=frame, facial_area=(x, y, w, h)
+            )
+
+            if is_real:
                 # If face is REAL (green box)
-                color = (0, 255, 0)
-
-                # Perform recognition
                 # If the .pkl file was deleted, DeepFace.find will automatically recreate it here.
                 dfs = DeepFace.find(
-                    img_path=frame[y:y+h, x:x+w],
+                    img_path=frame[max(0, y):y+h, max(0, x):x+w],
                     db_path=db_path,
+                    model_name=MODEL_NAME,
+                    detector_backend=DETECTOR_BACKEND,
                     enforce_detection=False,
                     silent=True
                 )
@@ -100,32 +123,34 @@ while True:
                     # Match found
                     identity = dfs[0]['identity'][0]
                     name = os.path.basename(os.path.dirname(identity))
-                    label = name
+                    tracker.set_identity(track, name, (0, 255, 0), True, frame_index)
                 else:
                     # No match found
-                    label = "Unknown"
+                    tracker.set_identity(track, "Unknown", (0, 255, 0), False, frame_index)
 
             else:
                 # If face is a SPOOF (red box)
-                color = (0, 0, 255)
-                label = "SPOOF"
-
-            # Draw the box and the label
-            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-            cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+                tracker.set_identity(track, "SPOOF", (0, 0, 255), False, frame_index)
 
     except Exception:
         # Silently ignore any errors in the loop to keep the stream running
         pass
+    frame_index += 1
+
+    return [(track.box, track.label, track.color) for track in tracker.tracks if track.label is not None]
+
 
-    # Show the final frame
-    cv2.imshow("Face Recognition", frame)
+def draw_results(frame, results):
+    # Draw every tracked box with its cached label
+    for (x, y, w, h), label, color in results:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+        cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
 
-    # Quit if 'q' is pressed
-    if cv2.waitKey(1) == ord('q'):
-        break
 
-# --- Cleanup ---
-cap.release()
-cv2.destroyAllWindows()
+# --- Main Loop ---
+print("-> Stream starting. Press 'q' in the window to quit.")
+if not run_pipeline(VIDEO_SOURCE, process_frame, draw_results, "Face Recognition", drop_frames=DROP_FRAMES):
+    print("---!!! FATAL ERROR !!!---")
+    print(f"Cannot open video source '{VIDEO_SOURCE}'. Check if the webcam is connected or used by another program, or that the file exists.")
+    exit()
 print("Stream finished.")
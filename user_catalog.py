@@ -0,0 +1,146 @@
+import os
+import threading
+from embedding_store import IMAGE_EXTENSIONS
+
+# --- User Catalog ---
+# In-memory index of the users in the database folder and their stored
+# images (file size and whether the image has an embedding), so listing users
+# and images and checking for an empty database never walk the folder. It is
+# built from disk once at startup, independently of the embedding store so a
+# gallery that fails to load doesn't hide the users, then marked with the
+# embedded images once the gallery is loaded, and kept current by /register
+# and /delete; with gunicorn, each worker applies the other workers' changes
+# as it picks up a new shared gallery.
+
+IMAGE_SUFFIXES = tuple(ext.lstrip("*") for ext in IMAGE_EXTENSIONS)
+
+
+class UserCatalog:
+    """
+    users: name -> {filename: {"bytes": size, "embedded": bool}}.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.users = {}
+        self.built = False
+        self.lock = threading.RLock()
+        self._names = None  # sorted user names, rebuilt after users are added or removed
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, name):
+        return name in self.users
+
+    def rebuild(self, embedded_identities=()):
+        """
+        Scans the database folder: one directory listing per user.
+        embedded_identities are the identities ('name/file.jpg') in the gallery.
+        """
+        embedded = set(embedded_identities)
+        users = {}
+        with os.scandir(self.db_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                images = {}
+                with os.scandir(entry.path) as files:
+                    for file in files:
+                        if file.name.lower().endswith(IMAGE_SUFFIXES) and file.is_file():
+                            images[file.name] = {
+                                "bytes": file.stat().st_size,
+                                "embedded": os.path.join(entry.name, file.name) in embedded,
+                            }
+                users[entry.name] = images
+        with self.lock:
+            self.users = users
+            self.built = True
+            self._names = None
+
+    # --- Updates ---
+
+    def mark_embedded(self, identities):
+        """
+        Flags the images in the gallery as embedded and all others as not.
+        """
+        embedded = set(identities)
+        with self.lock:
+            for name, images in self.users.items():
+                for filename, image in images.items():
+                    image["embedded"] = os.path.join(name, filename) in embedded
+
+    def add_image(self, name, filename, size, embedded=True):
+        with self.lock:
+            if name not in self.users:
+                self._names = None
+            self.users.setdefault(name, {})[filename] = {"bytes": size, "embedded": embedded}
+
+    def remove_user(self, name):
+        with self.lock:
+            if self.users.pop(name, None) is not None:
+                self._names = None
+
+    def sync_gallery(self, identities):
+        """
+        Applies another process's registrations and deletions, given the
+        identities now in the shared gallery. Only new images are stat'ed.
+        """
+        with self.lock:
+            if not self.built:
+                return
+            current = set(identities)
+            known = {os.path.join(name, filename) for name, images in self.users.items()
+                     for filename, image in images.items() if image["embedded"]}
+            added, removed = current - known, known - current
+            if not added and not removed:
+                return
+            for identity in removed:
+                name, filename = os.path.split(identity)
+                if name not in self.users:
+                    continue
+                if os.path.isdir(os.path.join(self.db_path, name)):
+                    self.users[name].pop(filename, None)
+                else:
+                    # The user was deleted
+                    self.remove_user(name)
+            for identity in added:
+                name, filename = os.path.split(identity)
+                try:
+                    size = os.path.getsize(os.path.join(self.db_path, identity))
+                except OSError:
+                    continue
+                self.add_image(name, filename, size)
+
+    # --- Queries ---
+
+    def names(self):
+        with self.lock:
+            if self._names is None:
+                self._names = sorted(self.users)
+            return self._names
+
+    def page(self, page, per_page):
+        """
+        Returns (user names on the 1-based page, total number of users).
+        """
+        names = self.names()
+        start = (page - 1) * per_page
+        return names[start:start + per_page], len(names)
+
+    def images(self, name):
+        """
+        Returns the sorted image file names of a user, or None if unknown.
+        """
+        with self.lock:
+            images = self.users.get(name)
+            return None if images is None else sorted(images)
+
+    def summary(self, name):
+        with self.lock:
+            images = self.users.get(name, {})
+            return {
+                "images": len(images),
+                "bytes": sum(image["bytes"] for image in images.values()),
+                "embedded": sum(image["embedded"] for image in images.values()),
+            }
@@ -0,0 +1,219 @@
+import threading
+import time
+import cv2
+
+# --- Video Pipeline ---
+# Runs the webcam scripts as three stages so a slow model never stalls the
+# camera: a capture thread that keeps only the newest frame, an inference
+# thread that processes whatever frame is newest when it becomes free, and the
+# main thread, which shows the newest frame with the latest results and an
+# FPS/latency overlay. Reading a video file instead of the camera works the
+# same way, so the scripts can be tested without a webcam.
+
+
+def open_source(source):
+    """
+    Opens a camera index (an int or a string of digits) or a video file path.
+    """
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    return cv2.VideoCapture(source)
+
+
+class FrameSource:
+    """
+    Capture thread holding a single-frame buffer.
+
+    With drop_frames=True a new frame replaces one the inference stage has not
+    picked up yet (counted in `dropped`), so inference always works on the
+    newest frame. With drop_frames=False capture waits for every frame to be
+    consumed, which processes a video file frame by frame.
+    """
+
+    def __init__(self, source, drop_frames=True):
+        self.cap = open_source(source)
+        self.is_file = not isinstance(source, int) and not (isinstance(source, str) and source.isdigit())
+        self.drop_frames = drop_frames
+        self.condition = threading.Condition()
+        self.frame = None
+        self.index = -1
+        self.captured_at = 0.0
+        self.consumed = True
+        self.dropped = 0
+        self.ended = False
+        self.thread = None
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.ended = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.cap.release()
+
+    def _run(self):
+        # Play files back at their own frame rate so they behave like a camera
+        frame_interval = 0.0
+        if self.is_file and self.drop_frames:
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
+        next_frame_at = time.perf_counter()
+
+        while not self.ended:
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            with self.condition:
+                if not self.drop_frames:
+                    while not self.consumed and not self.ended:
+                        self.condition.wait()
+                elif not self.consumed:
+                    self.dropped += 1
+                self.frame = frame
+                self.index += 1
+                self.captured_at = time.perf_counter()
+                self.consumed = False
+                self.condition.notify_all()
+
+            if frame_interval:
+                next_frame_at += frame_interval
+                time.sleep(max(0.0, next_frame_at - time.perf_counter()))
+
+        with self.condition:
+            self.ended = True
+            self.condition.notify_all()
+
+    def latest(self):
+        """
+        Returns the newest (index, frame, captured_at) without consuming it.
+        """
+        with self.condition:
+            return self.index, self.frame, self.captured_at
+
+    def read(self, timeout=0.1):
+        """
+        Takes the newest unconsumed frame for inference. Returns
+        (index, frame, captured_at), or None on timeout or when the source ended.
+        """
+        with self.condition:
+            if self.consumed and not self.ended:
+                self.condition.wait(timeout)
+            if self.consumed:
+                return None
+            self.consumed = True
+            self.condition.notify_all()
+            return self.index, self.frame, self.captured_at
+
+
+class InferenceStage:
+    """
+    Thread that runs process_fn(frame) on the newest captured frame and keeps
+    the latest result along with its latency and throughput.
+    """
+
+    def __init__(self, frames, process_fn):
+        self.frames = frames
+        self.process_fn = process_fn
+        self.lock = threading.Lock()
+        self.results = []
+        self.processed = 0
+        self.latency_ms = 0.0
+        self.fps = 0.0
+        self.done = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.frames.read()
+            if item is None:
+                if self.frames.ended:
+                    break
+                continue
+            _, frame, captured_at = item
+            started = time.perf_counter()
+            try:
+                results = self.process_fn(frame)
+            except Exception as e:
+                print(f"---!!! WARNING: Inference failed on a frame: {e} !!!---")
+                results = []
+            finished = time.perf_counter()
+            with self.lock:
+                self.results = results
+                self.processed += 1
+                self.latency_ms = (finished - captured_at) * 1000
+                # Exponential moving average of the inference rate
+                rate = 1.0 / max(finished - started, 1e-6)
+                self.fps = rate if self.processed == 1 else 0.9 * self.fps + 0.1 * rate
+        self.done = True
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.results), self.latency_ms, self.fps
+
+
+def draw_hud(frame, display_fps, inference_fps, latency_ms, dropped):
+    lines = [
+        f"display {display_fps:5.1f} fps",
+        f"inference {inference_fps:5.1f} fps",
+        f"latency {latency_ms:6.1f} ms",
+        f"dropped {dropped}",
+    ]
+    for i, line in enumerate(lines):
+        cv2.putText(frame, line, (10, 20 + 20 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+
+def run_pipeline(source, process_fn, draw_fn, window_name, drop_frames=True, show_hud=True):
+    """
+    Runs capture, inference and display until 'q' is pressed or the source ends.
+    process_fn(frame) returns results for draw_fn(frame, results) to overlay.
+    Returns False if the source could not be opened.
+    """
+    frames = FrameSource(source, drop_frames=drop_frames)
+    if not frames.is_opened():
+        return False
+    inference = InferenceStage(frames, process_fn)
+    frames.start()
+    inference.start()
+
+    shown_index = -1
+    display_fps = 0.0
+    last_shown = time.perf_counter()
+    try:
+        while not inference.done:
+            index, frame, _ = frames.latest()
+            if frame is None or index == shown_index:
+                # Nothing new to show yet
+                if cv2.waitKey(1) == ord('q'):
+                    break
+                continue
+            shown_index = index
+
+            frame = frame.copy()
+            results, latency_ms, inference_fps = inference.snapshot()
+            draw_fn(frame, results)
+
+            now = time.perf_counter()
+            rate = 1.0 / max(now - last_shown, 1e-6)
+            display_fps = rate if display_fps == 0 else 0.9 * display_fps + 0.1 * rate
+            last_shown = now
+            if show_hud:
+                draw_hud(frame, display_fps, inference_fps, latency_ms, frames.dropped)
+
+            cv2.imshow(window_name, frame)
+            if cv2.waitKey(1) == ord('q'):
+                break
+    finally:
+        frames.stop()
+        cv2.destroyAllWindows()
+    return True